@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks the startup of a service that publishes many paths: adding them one by one with
+add_path, at once with add_paths, and at once on a virtual service.
+
+The paths are exported on the session bus, or on the system bus when there is no session bus.
+The service name itself is not registered.
+
+Usage: python3 benchmarks/add_paths.py [--paths 5000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../velib_python'))
+from vedbus import VeDbusService
+
+def make_paths(count):
+	# Ten paths per device, in groups of ten devices, so there are nodes at several levels
+	names = ('V', 'I', 'P', 'T', 'Soc', 'State', 'Alarm', 'Mode', 'Yield', 'Name')
+	return ['/Device/%d/%d/%s' % (i // 100, (i // 10) % 10, names[i % 10]) for i in range(count)]
+
+def one_by_one(paths, virtual=False):
+	service = VeDbusService('com.victronenergy.benchmark.addpaths', register=False, virtual=virtual)
+	for p in paths:
+		service.add_path(p, 0)
+	service.__del__()
+
+def bulk(paths, virtual=False):
+	service = VeDbusService('com.victronenergy.benchmark.addpaths', register=False, virtual=virtual)
+	service.add_paths((p, 0) for p in paths)
+	service.__del__()
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+	parser.add_argument('--paths', type=int, default=5000, help='number of paths to add')
+	parser.add_argument('--repeat', type=int, default=3, help='number of measurements, the best is shown')
+	args = parser.parse_args()
+
+	paths = make_paths(args.paths)
+	results = []
+	for name, func, virtual in (
+			('add_path', one_by_one, False),
+			('add_paths', bulk, False),
+			('add_paths virtual', bulk, True)):
+		t = min(timeit.repeat(lambda: func(paths, virtual), number=1, repeat=args.repeat))
+		results.append(t)
+		print("%-18s %8.1f ms for %d paths, %5.1fx" % (name, t * 1e3, args.paths, results[0] / t))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks GetValue and GetText on an intermediate node of a service with many paths, such as
+a GUI polling /Ac. Compares the sorted path index of VeDbusService with checking every path with
+startswith, as was done before.
+
+The paths are exported on the session bus, or on the system bus when there is no session bus, but
+the handlers are called directly, so that only the lookup is measured and not the dbus round trip.
+
+Usage: python3 benchmarks/subtree.py [--paths 10000] [--number 1000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../velib_python'))
+from vedbus import VeDbusService
+
+# Returns the values below path, as VeDbusService._get_tree_values did without the path index
+def get_tree_values_linear(service, path):
+	r = {}
+	px = path if path.endswith('/') else path + '/'
+	for p, item in service._dbusobjects.items():
+		if p.startswith(px):
+			r[p[len(px):]] = item.GetValue()
+	return r
+
+def make_paths(count):
+	# A few small subtrees, like those of a real device, and one large one
+	paths = ['/Ac/L%d/%s' % (l, n) for l in (1, 2, 3) for n in ('V', 'I', 'P', 'F')]
+	paths += ['/Dc/0/%s' % n for n in ('Voltage', 'Current', 'Power')]
+	i = 0
+	while len(paths) < count:
+		paths.append('/Pv/%d/%s' % (i // 4, ('V', 'I', 'P', 'Yield')[i % 4]))
+		i += 1
+	return paths[:count]
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+	parser.add_argument('--paths', type=int, default=10000, help='number of paths to export')
+	parser.add_argument('--number', type=int, default=1000, help='queries per measurement')
+	args = parser.parse_args()
+
+	service = VeDbusService('com.victronenergy.benchmark.subtree', register=False)
+	service.add_paths((p, 0) for p in make_paths(args.paths))
+
+	for node in ('/Ac', '/Ac/L1', '/Dc/0', '/Pv/7'):
+		assert service._get_tree_values(node) == get_tree_values_linear(service, node)
+		indexed = min(timeit.repeat(lambda: service._get_tree_values(node),
+			number=args.number, repeat=5)) / args.number
+		linear = min(timeit.repeat(lambda: get_tree_values_linear(service, node),
+			number=args.number, repeat=5)) / args.number
+		print("GetValue %-8s %6.1f us indexed, %8.1f us scanning %d paths, %5.0fx" % (
+			node, indexed * 1e6, linear * 1e6, args.paths, linear / indexed))
+
+	text = min(timeit.repeat(lambda: service._get_tree_values('/Ac', get_text=True),
+		number=args.number, repeat=5)) / args.number
+	print("GetText  %-8s %6.1f us indexed" % ('/Ac', text * 1e6))
+
+	service.__del__()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmarks for wrap_dbus_value and unwrap_dbus_value, with scalar, array and dict payloads.
+
+Each is compared with the isinstance checks in _wrap_dbus_value and _unwrap_dbus_value, which are
+the fallback for types that are not in the dispatch tables. Only the outer value goes through the
+fallback, the elements of an array or dict are still dispatched on their type.
+
+Only needs dbus-python, no bus.
+
+Usage: python3 benchmarks/wrap_unwrap.py [--number 100000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../velib_python'))
+from ve_utils import wrap_dbus_value, unwrap_dbus_value, _wrap_dbus_value, _unwrap_dbus_value
+
+def payloads():
+	scalars = [('None', None), ('int', 230), ('float', 49.98), ('str', 'Bulk'), ('bool', True)]
+	array = [('array 100 floats', [0.1 * i for i in range(100)])]
+	# Shaped like the reply to GetItems
+	items = [('dict 100 items', {'/Path/%d' % i: {'Value': i * 0.5, 'Text': '%.1fV' % (i * 0.5)}
+		for i in range(100)})]
+	return scalars + array + items
+
+def measure(func, value, number):
+	return min(timeit.repeat(lambda: func(value), number=number, repeat=5)) / number
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+	parser.add_argument('--number', type=int, default=100000, help='calls per scalar measurement')
+	args = parser.parse_args()
+
+	print("%-20s %11s %11s %13s %13s" % ('', 'wrap', 'isinstance', 'unwrap', 'isinstance'))
+	for name, value in payloads():
+		# Containers take some hundred times longer than a scalar
+		number = args.number if name in ('None', 'int', 'float', 'str', 'bool') else args.number // 100
+		wrapped = wrap_dbus_value(value)
+		assert unwrap_dbus_value(wrapped) == value
+		assert _unwrap_dbus_value(wrapped) == value
+
+		print("%-20s %8.3f us %8.3f us %10.3f us %10.3f us" % (name,
+			measure(wrap_dbus_value, value, number) * 1e6,
+			measure(_wrap_dbus_value, value, number) * 1e6,
+			measure(unwrap_dbus_value, wrapped, number) * 1e6,
+			measure(_unwrap_dbus_value, wrapped, number) * 1e6))
+
+if __name__ == "__main__":
+	main()
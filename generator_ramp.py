@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 import json
+import logging
 import os
 import sys
+from collections import namedtuple
 from os.path import join, dirname, exists
-from pprint import pformat, pprint
+from pprint import pformat
 from time import time, sleep
 
 import dbus
 from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
 
 # our own packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'velib_python'))
 
 from vedbus import VeDbusItemImport
-from ve_utils import unwrap_dbus_value
+from ve_utils import unwrap_dbus_value, add_name_owner_changed_receiver
+from settingsdevice import SettingsDevice
+from logger import setup_logging, RepeatFilter
+
+logger = logging.getLogger("generator_ramp")
 
 INV_SWITCH_OFF = 4
 INV_SWITCH_ON = 3
@@ -25,6 +32,11 @@ TIMESTEP = 0.25
 
 EXCEPTION_THRESHOLD = 10
 
+# Only wait for the rest of the system to start when we were started shortly after boot, not when the
+# service was restarted after a crash.
+STARTUP_DELAY = 5
+STARTUP_DELAY_MAX_UPTIME = 300
+
 
 # TODO Update the ramp function to look for the AC input 1 voltage to stabilise before beginning the timer.
 # Parameters for generator ramp function
@@ -37,6 +49,64 @@ GENSET_STANDBY_RAMP_TIME = 120
 GENSET_PRIME_CURRENT_LIMIT = 40
 GENSET_PRIME_RAMP_TIME = 30*60
 
+# The parameters above can be tuned at runtime through localsettings. Those are the defaults, used when
+# localsettings is not available.
+RampParams = namedtuple("RampParams", [
+    "timestep",
+    "initial_limit",
+    "initial_ramp_time",
+    "warmup_time",
+    "warmup_current_limit",
+    "standby_current_limit",
+    "standby_ramp_time",
+    "prime_current_limit",
+    "prime_ramp_time",
+])
+
+DEFAULT_PARAMS = RampParams(
+    timestep=TIMESTEP,
+    initial_limit=GENSET_INITIAL_LIMIT,
+    initial_ramp_time=GENSET_INITIAL_RAMP_TIME,
+    warmup_time=GENSET_WARMUP_TIME,
+    warmup_current_limit=GENSET_WARMUP_CURRENT_LIMIT,
+    standby_current_limit=GENSET_STANDBY_CURRENT_LIMIT,
+    standby_ramp_time=GENSET_STANDBY_RAMP_TIME,
+    prime_current_limit=GENSET_PRIME_CURRENT_LIMIT,
+    prime_ramp_time=GENSET_PRIME_RAMP_TIME,
+)
+
+# Setting name: [path, default, min, max], see SettingsDevice
+RAMP_SETTINGS = {
+    "timestep": ["/Settings/GeneratorRamp/TimeStep", TIMESTEP, 0.05, 5.0],
+    "initial_limit": ["/Settings/GeneratorRamp/InitialLimit", GENSET_INITIAL_LIMIT, 0, 100],
+    "initial_ramp_time": ["/Settings/GeneratorRamp/InitialRampTime", GENSET_INITIAL_RAMP_TIME, 1, 3600],
+    "warmup_time": ["/Settings/GeneratorRamp/WarmupTime", GENSET_WARMUP_TIME, 0, 3600],
+    "warmup_current_limit": ["/Settings/GeneratorRamp/WarmupCurrentLimit", GENSET_WARMUP_CURRENT_LIMIT, 0, 100],
+    "standby_current_limit": ["/Settings/GeneratorRamp/StandbyCurrentLimit", GENSET_STANDBY_CURRENT_LIMIT, 0, 100],
+    "standby_ramp_time": ["/Settings/GeneratorRamp/StandbyRampTime", GENSET_STANDBY_RAMP_TIME, 1, 3600],
+    "prime_current_limit": ["/Settings/GeneratorRamp/PrimeCurrentLimit", GENSET_PRIME_CURRENT_LIMIT, 0, 100],
+    "prime_ramp_time": ["/Settings/GeneratorRamp/PrimeRampTime", GENSET_PRIME_RAMP_TIME, 1, 4*3600],
+}
+
+SETTINGS_SERVICE = "com.victronenergy.settings"
+
+# Seconds to wait for the initial values of new importers, before asking the paths one by one
+IMPORT_TIMEOUT = 1
+
+
+def validate_params(params):
+    """ Returns a list with the problems of a RampParams, empty when it can be used. """
+    problems = []
+    if params.timestep <= 0:
+        problems.append(f"timestep {params.timestep} must be positive")
+    for name in ("initial_ramp_time", "standby_ramp_time", "prime_ramp_time"):
+        if getattr(params, name) <= 0:
+            problems.append(f"{name} must be positive")
+    if not (params.initial_limit <= params.warmup_current_limit <= params.standby_current_limit
+            <= params.prime_current_limit):
+        problems.append("current limits must increase from initial to warmup, standby and prime")
+    return problems
+
 STATE_INV_OFF = 0
 STATE_INV_ON = 1
 STATE_START_REQD = 2
@@ -57,6 +127,18 @@ class GeneratorRampController:
     def __init__(self):
         DBusGMainLoop(set_as_default=True)
         self.dbusConn = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
+        # Subscribed before anything is looked up on the dbus, so that no service that appears is missed.
+        # The importers cache the values, so they are recreated when their service leaves or comes back.
+        add_name_owner_changed_receiver(self.dbusConn, self.handle_name_owner_changed)
+
+        # Parameters used by the ramp. Replaced as a whole when a setting changes, so a tick never sees a
+        # mix of old and new values.
+        self.params = DEFAULT_PARAMS
+        # Without localsettings the ramp starts on the defaults right away, the settings are registered
+        # when localsettings appears on the dbus, see handle_name_owner_changed
+        self.settings = None
+        self.register_settings()
+
         self.battery_charge_current_limit = 0
         self.battery_discharge_current_limit = 0
         self.ac_input_current_limit = None
@@ -73,12 +155,9 @@ class GeneratorRampController:
         self.tick_time = time()
         self.generator_state_entry_time = time()
         self.generator_stall_counter = 0
-        self.ac_input_curr_limit_target = GENSET_INITIAL_LIMIT
+        self.ac_input_curr_limit_target = self.params.initial_limit
         self.relay_states = {0 : None}
 
-        self._last_log = {}
-        self.duplicate_log_counter = {}
-
         self.logged_vars = {}
 
         self.outputs_str = ""
@@ -116,10 +195,10 @@ class GeneratorRampController:
     @property
     def Fault_Detected(self):
         if not self.BMS_connected:
-            print("BMS Fault", flush=True)
+            logger.warning("BMS Fault")
             return True
         if (self.inverter_switch_mode != INV_SWITCH_OFF) and (not self.inverter_connected):
-            print("Inverter Fault", flush=True)
+            logger.warning("Inverter Fault")
             return True
         return False
     #
@@ -141,47 +220,50 @@ class GeneratorRampController:
 
     def get_dbus_value(self, dbus_item_name: str):
         if (dbus_item := self.dbus_items.get(dbus_item_name)) is not None:
-            # print(f"Get DBus Value () : {dbus_item.serviceName} - {dbus_item.path}", flush=True)
+            # logger.debug("Get DBus Value () : %s - %s", dbus_item.serviceName, dbus_item.path)
+            # Kept up to date by the PropertiesChanged signals. The service is only asked directly when
+            # the initial value didn't arrive within IMPORT_TIMEOUT, see wait_for_importers
+            if dbus_item.ready:
+                return dbus_item.get_value()
             t0 = time()
             try:
                 return unwrap_dbus_value(dbus_item._proxy.GetValue())
             except dbus.exceptions.DBusException as e:
-                print(f"Could not get DBUS Item : {dbus_item.serviceName} - {dbus_item.path}", flush=True)
-                print(e, flush=True)
+                logger.warning("Could not get DBUS Item : %s - %s : %s", dbus_item.serviceName, dbus_item.path, e)
                 self.clear_dbus_item(dbus_item_name)
                 duration = time() - t0
                 timeout = 10
                 if duration > timeout:
-                    print(f"Call took more than {timeout}s, potentially unrecoverable situation! raising exception!")
+                    logger.error("Call took more than %ss, potentially unrecoverable situation! raising exception!", timeout)
                     raise
 
     def set_dbus_value(self, dbus_item_name: str, value):
         if (dbus_item := self.dbus_items.get(dbus_item_name)) is not None:
-            # print(f"Set DBus Value () : {dbus_item.serviceName} - {dbus_item.path} : {Value}", flush=True))
+            # logger.debug("Set DBus Value () : %s - %s : %s", dbus_item.serviceName, dbus_item.path, value)
             t0 = time()
             try:
                 dbus_item.set_value(value)
                 return True
             except dbus.exceptions.DBusException as e:
-                print(f"Could not set DBUS Item : {dbus_item.serviceName} - {dbus_item.path} : {value}", flush=True)
-                print(e, flush=True)
+                logger.warning("Could not set DBUS Item : %s - %s : %s : %s", dbus_item.serviceName, dbus_item.path, value, e)
                 self.clear_dbus_item(dbus_item_name)
                 duration = time() - t0
                 timeout = 10
                 if duration > timeout:
-                    print(f"Call took more than {timeout}s, potentially unrecoverable situation! raising exception!")
+                    logger.error("Call took more than %ss, potentially unrecoverable situation! raising exception!", timeout)
                     raise
                 return False
-        print(f"Dbus Item has been cleared so cannot be set until it is reconnected : {dbus_item_name} ")
+        logger.warning("Dbus Item has been cleared so cannot be set until it is reconnected : %s", dbus_item_name)
         return False
 
     def clear_dbus_item(self, dbus_item_name):
-        print(f"Removing dbus item : {dbus_item_name}", flush=True)
+        logger.info("Removing dbus item : %s", dbus_item_name)
         try: # Try to remove the offending dbus item
             dbus_item = self.dbus_items.pop(dbus_item_name)
-            del dbus_item
+            if dbus_item is not None:
+                dbus_item.close()
         except KeyError:
-            print("Could not find dbus item to remove", flush=True)
+            logger.warning("Could not find dbus item to remove")
 
     def update_battery_limits(self):
         charge_lim = self.get_dbus_value("battery_charge_limit")
@@ -192,7 +274,7 @@ class GeneratorRampController:
             self.battery_discharge_current_limit = round(discharge_lim, 1)
         else:
             self.BMS_connected = False
-            print("Did not receive data from battery about current limits", flush=True)
+            logger.warning("Did not receive data from battery about current limits")
 
     def update_ac_input_current_limit(self):
         val = self.get_dbus_value("ac_input_current_limit")
@@ -201,7 +283,7 @@ class GeneratorRampController:
             self.ac_input_current_limit = round(val, 1)
         else:
             self.inverter_connected = False
-            print("Did not receive data from inverter", flush=True)
+            logger.warning("Did not receive data from inverter")
             self.ac_input_current_limit = None
             self.clear_dbus_item("ac_input_current_limit")
 
@@ -212,7 +294,7 @@ class GeneratorRampController:
             self.inverter_switch_mode = val
         else:
             self.inverter_connected = False
-            print("Did not receive switch mode from inverter", flush=True)
+            logger.warning("Did not receive switch mode from inverter")
             self.inverter_switch_mode = 0
 
     def update_relay_states(self):
@@ -227,7 +309,7 @@ class GeneratorRampController:
             self.ac_input_current = round(val, 1)
         else:
             self.inverter_connected = False
-            print("Did not receive data from inverter", flush=True)
+            logger.warning("Did not receive data from inverter")
             self.ac_input_current = None
             self.clear_dbus_item("ac_input1_I")
 
@@ -240,13 +322,42 @@ class GeneratorRampController:
             if (self.Battery_Contactors_Closed):  # Only attempt to contol the inverter if the 48V system has become live already
                 if self.inverter_delay == 0:
                     self.set_dbus_value("ac_input_current_limit", self.ac_input_curr_limit_target)
-                    print(f"Updating AC Current Limit from {self.ac_input_current_limit} to {self.ac_input_curr_limit_target}.", flush=True)
+                    logger.info("Updating AC Current Limit from %s to %s.", self.ac_input_current_limit, self.ac_input_curr_limit_target)
                 else:
-                    print(f"Waiting {self.inverter_delay}s before updating ac input current limit")
+                    logger.info("Waiting %ss before updating ac input current limit", self.inverter_delay)
                     # inverter_delay is decremented elsewhere.
 
+    def load_params(self):
+        values = {}
+        for name in RampParams._fields:
+            value = self.settings[name]
+            values[name] = getattr(DEFAULT_PARAMS, name) if value is None else value
+        params = RampParams(**values)
+        problems = validate_params(params)
+        if problems:
+            logger.warning("Ignoring invalid ramp parameters %s : %s", params, ', '.join(problems))
+            return
+        if params != self.params:
+            logger.info("Ramp parameters : %s", params)
+        self.params = params
+
+    def register_settings(self):
+        try:
+            self.settings = SettingsDevice(self.dbusConn, RAMP_SETTINGS, self.handle_setting_changed,
+                                           name=SETTINGS_SERVICE, timeout=0, batched=True)
+        except Exception as e:
+            self.settings = None
+            logger.warning("Could not register settings, using the default ramp parameters : %s", e)
+        else:
+            self.load_params()
+
+    def handle_setting_changed(self, setting, oldvalue, newvalue):
+        # Called from the main context iteration at the start of a tick, the new parameters apply to that tick
+        self.load_params()
+
     def update_ramp_state_machine(self):
         incoming_state = self.generator_ramp_state
+        p = self.params
 
         if self.generator_ramp_state == STATE_INV_OFF:
             if self.inverter_connected:
@@ -263,65 +374,65 @@ class GeneratorRampController:
                 self.generator_ramp_state = STATE_INV_OFF
             elif self.generator_start_requested == False:
                 self.generator_ramp_state = STATE_INV_ON
-            elif self.ac_input_current > GENSET_INITIAL_LIMIT / 2.0:
+            elif self.ac_input_current > p.initial_limit / 2.0:
                 self.generator_ramp_state = STATE_INITIAL_RAMP
 
-            self.ac_input_curr_limit_target = GENSET_INITIAL_LIMIT
+            self.ac_input_curr_limit_target = p.initial_limit
 
         elif self.generator_ramp_state == STATE_INITIAL_RAMP:
             if self.inverter_connected == False:
                 self.generator_ramp_state = STATE_INV_OFF
             elif self.generator_start_requested == False:
                 self.generator_ramp_state = STATE_INV_ON
-            elif self.generator_state_time > GENSET_INITIAL_RAMP_TIME:
+            elif self.generator_state_time > p.initial_ramp_time:
                 self.generator_ramp_state = STATE_WARMUP
             elif self.ac_input_current == 0.0:
                 self.generator_ramp_state = STATE_INV_ON
                 self.generator_stall_counter += 1
 
-            self.ac_input_curr_limit_target = self.ramp_calc(self.generator_state_time, GENSET_INITIAL_RAMP_TIME,
-                                                             GENSET_INITIAL_LIMIT, GENSET_WARMUP_CURRENT_LIMIT)
+            self.ac_input_curr_limit_target = self.ramp_calc(self.generator_state_time, p.initial_ramp_time,
+                                                             p.initial_limit, p.warmup_current_limit)
 
         elif self.generator_ramp_state == STATE_WARMUP:
             if self.inverter_connected == False:
                 self.generator_ramp_state = STATE_INV_OFF
             elif self.generator_start_requested == False:
                 self.generator_ramp_state = STATE_INV_ON
-            elif self.generator_state_time > GENSET_WARMUP_TIME:
+            elif self.generator_state_time > p.warmup_time:
                 self.generator_ramp_state = STATE_STANDBY_RAMP
             elif self.ac_input_current == 0.0:
                 self.generator_ramp_state = STATE_INV_ON
                 self.generator_stall_counter += 1
 
-            self.ac_input_curr_limit_target = GENSET_WARMUP_CURRENT_LIMIT
+            self.ac_input_curr_limit_target = p.warmup_current_limit
 
         elif self.generator_ramp_state == STATE_STANDBY_RAMP:
             if self.inverter_connected == False:
                 self.generator_ramp_state = STATE_INV_OFF
             elif self.generator_start_requested == False:
                 self.generator_ramp_state = STATE_INV_ON
-            elif self.generator_state_time > GENSET_STANDBY_RAMP_TIME:
+            elif self.generator_state_time > p.standby_ramp_time:
                 self.generator_ramp_state = STATE_PRIME_RAMP
             elif self.ac_input_current == 0.0:
                 self.generator_ramp_state = STATE_INV_ON
                 self.generator_stall_counter += 1
 
-            self.ac_input_curr_limit_target = self.ramp_calc(self.generator_state_time, GENSET_STANDBY_RAMP_TIME,
-                                                             GENSET_WARMUP_CURRENT_LIMIT, GENSET_STANDBY_CURRENT_LIMIT)
+            self.ac_input_curr_limit_target = self.ramp_calc(self.generator_state_time, p.standby_ramp_time,
+                                                             p.warmup_current_limit, p.standby_current_limit)
 
         elif self.generator_ramp_state == STATE_PRIME_RAMP:
             if self.inverter_connected == False:
                 self.generator_ramp_state = STATE_INV_OFF
             elif self.generator_start_requested == False:
                 self.generator_ramp_state = STATE_INV_ON
-            elif self.generator_state_time > GENSET_PRIME_RAMP_TIME:
+            elif self.generator_state_time > p.prime_ramp_time:
                 self.generator_ramp_state = STATE_STEADYSTATE
             elif self.ac_input_current == 0.0:
                 self.generator_ramp_state = STATE_INV_ON
                 self.generator_stall_counter += 1
 
-            self.ac_input_curr_limit_target = self.ramp_calc(self.generator_state_time, GENSET_PRIME_RAMP_TIME,
-                                                             GENSET_STANDBY_CURRENT_LIMIT, GENSET_PRIME_CURRENT_LIMIT)
+            self.ac_input_curr_limit_target = self.ramp_calc(self.generator_state_time, p.prime_ramp_time,
+                                                             p.standby_current_limit, p.prime_current_limit)
 
         elif self.generator_ramp_state == STATE_STEADYSTATE:
             if self.inverter_connected == False:
@@ -331,7 +442,7 @@ class GeneratorRampController:
             elif self.ac_input_current == 0.0:
                 self.generator_ramp_state = STATE_INV_ON
 
-            self.ac_input_curr_limit_target = GENSET_PRIME_CURRENT_LIMIT
+            self.ac_input_curr_limit_target = p.prime_current_limit
 
         else:
             pass
@@ -358,7 +469,9 @@ class GeneratorRampController:
         counter = 0
         while True:
             self.tick_time = time()
+            self.pump_main_context()
             self.check_and_create_connections()
+            self.wait_for_importers(IMPORT_TIMEOUT)
 
             self.update_battery_limits()
             if (self.inverter_switch_mode == INV_SWITCH_ON) or (self.inverter_switch_mode == INV_SWITCH_CHARGE_ONLY):
@@ -371,40 +484,26 @@ class GeneratorRampController:
             self.set_ac_input_current_limit()
 
             # if (self.Service_Restart_Requested):
-            #     print("Service Restart Requested, Going Down in 5s!", flush=True)
+            #     logger.info("Service Restart Requested, Going Down in 5s!")
             #     self.store_state()
             #     sleep(5)
             #     exit()
-            # print(f"{datetime.isoformat(datetime.now())} : {self}", flush=True))
+            # logger.info("%s : %s", datetime.isoformat(datetime.now()), self)
             self.log_state()
 
             counter += 1
             if counter % 60 == 0:
                 self.snapshot_memory()
 
-            sleep(max(0.0, TIMESTEP - (time() - self.tick_time)))
+            sleep(max(0.0, self.params.timestep - (time() - self.tick_time)))
 
     def log_dbus_vals(self):
-        print(f"DBUS: {pformat(self.logged_vars, width=200)}")
-        sys.stdout.flush()
+        logger.info("DBUS: %s", pformat(self.logged_vars, width=200))
 
     def log_state(self):
-        log = {"Relays": self.relay_states, "State": str(self)}
-        for log_type in log.keys():
-            if log[log_type] == self._last_log.get(log_type):
-                self.duplicate_log_counter[log_type] = self.duplicate_log_counter.get(log_type, 0) + 1
-            else:
-                self.duplicate_log_counter[log_type] = 0
-            if (log[log_type] != self._last_log.get(log_type)) or ((self.duplicate_log_counter[log_type] % 10) == 0):
-                if isinstance(log[log_type], dict):
-                    print(f"{log_type}: {pformat(log[log_type], width=200)}")
-                else:
-                    print(f"{log_type}: {log[log_type]}".expandtabs(4))
-            else:
-                # print(f"{log_type}: No Change")
-                pass
-            self._last_log[log_type] = log[log_type]
-        sys.stdout.flush()
+        # Unchanged lines are only logged every 10th time, by the RepeatFilter set up in main
+        logger.info("Relays: %s", pformat(self.relay_states, width=200), extra={"repeatkey": "Relays"})
+        logger.info("State: %s", str(self).expandtabs(4), extra={"repeatkey": "State"})
 
     def snapshot_memory(self):
         if PROFILE_MEMORY:
@@ -413,16 +512,17 @@ class GeneratorRampController:
                 self._initial_snapshot = self._current_snapshot
             top_stats = self._current_snapshot.compare_to(self._initial_snapshot, 'lineno')
 
-            print("\n*************** Memory Snapshot Top 20 ***************\n")
+            lines = ["", "*************** Memory Snapshot Top 20 ***************"]
             count = 0
             for stat in top_stats:
                 if "tracemalloc.py" not in str(stat.traceback[0]):
                     count += 1
-                    print(stat)
+                    lines.append(str(stat))
                 if count >= 20:
                     break
 
-            print("\n******************************************************\n")
+            lines.append("******************************************************")
+            logger.info("%s", "\n".join(lines))
 
     def __repr__(self):
         return ',\t'.join([
@@ -444,72 +544,104 @@ class GeneratorRampController:
         for k, v in self.dbus_items_spec.items():
             if self.dbus_items.get(k) is None:
                 try:
-                    print(f"Creating DBUS Item - {v['service']} : {v['path']}")
-                    self.dbus_items[k] = VeDbusItemImport(self.dbusConn, v['service'], v['path'])
+                    logger.info("Creating DBUS Item - %s : %s", v['service'], v['path'])
+                    self.dbus_items[k] = VeDbusItemImport(self.dbusConn, v['service'], v['path'], blocking=False)
                 except Exception as e:
                     self.dbus_items[k] = None
-                    print(f"Could not find DBUS Item - {v['service']} : {v['path']}")
-                    print(e, flush=True)
+                    logger.warning("Could not find DBUS Item - %s : %s : %s", v['service'], v['path'], e)
+
+    def handle_name_owner_changed(self, name, oldowner, newowner):
+        # Called from the main context iteration at the start of a tick
+        if name == SETTINGS_SERVICE and newowner and self.settings is None:
+            self.register_settings()
+        for k, v in self.dbus_items_spec.items():
+            if v['service'] == name and self.dbus_items.get(k) is not None:
+                self.clear_dbus_item(k)
+
+    def wait_for_importers(self, timeout):
+        # New importers are seeded with one GetItems per service, wait for those replies
+        context = GLib.MainContext.default()
+        expired = []
+        timer = None
+        while any(i is not None and not i.ready for i in self.dbus_items.values()):
+            if expired:
+                return
+            if timer is None:
+                timer = GLib.timeout_add(int(timeout * 1000), lambda: expired.append(True))
+            context.iteration(True)
+        if timer is not None and not expired:
+            GLib.source_remove(timer)
+
+    @staticmethod
+    def pump_main_context():
+        # There is no GLib main loop running, so handle the pending signals and async D-Bus replies here
+        context = GLib.MainContext.default()
+        while context.iteration(False):
+            pass
 
     def system_uptime(self):
-        with open("/proc/uptime") as f:
-            return float(f.read().split()[0])
+        return system_uptime()
 
     def store_state(self):
         state = {"State": self.generator_ramp_state, "StateEntryTime": self.generator_state_entry_time, "Time": time()}
-        print("Storing State now ", flush=True)
-        print(state)
+        logger.info("Storing State now : %s", state)
         with open("state_dump.json", 'w') as f:
             json.dump(state, f)
     def check_stored_state(self):
-        print("Checking stored state")
+        logger.info("Checking stored state")
         if exists("state_dump.json"):
             with open("state_dump.json") as f:
                 state = json.load(f)
-                print("Stored state : ", flush=True)
-                pprint(state)
+                logger.info("Stored state : %s", pformat(state))
 
             age = (time() - state.get("Time", 0))
             if age < 120:
-                print(f"Found a stored state dump which is less than 60s old ({age}s)", flush=True)
+                logger.info("Found a stored state dump which is less than 60s old (%ss)", age)
                 if self.system_uptime() > state.get("Time", 0):
-                    print("System reboot detected more recently than stored state, ignoring stored state.",flush=True)
+                    logger.info("System reboot detected more recently than stored state, ignoring stored state.")
                 else:
                     ramp_state = state.get("State", 0)
                     if ramp_state > STATE_STEADYSTATE:
-                        print(f"Unknown State detected : {ramp_state}", flush=True)
+                        logger.warning("Unknown State detected : %s", ramp_state)
                     else:
-                        print(f"Restoring State : {ramp_state}", flush=True)
+                        logger.info("Restoring State : %s", ramp_state)
                         self.generator_ramp_state = ramp_state
                     ramp_state_entry_time = state.get("StateEntryTime", 0)
                     if ramp_state_entry_time < 0.0:
-                        print(f"Invalid State Entry Time detected : {ramp_state_entry_time}", flush=True)
+                        logger.warning("Invalid State Entry Time detected : %s", ramp_state_entry_time)
                     else:
-                        print(f"Restoring State Entry Time : {ramp_state_entry_time}", flush=True)
+                        logger.info("Restoring State Entry Time : %s", ramp_state_entry_time)
                         self.generator_state_entry_time = ramp_state_entry_time
         else:
-            print("No state_dump.json file detected", flush=True)
+            logger.info("No state_dump.json file detected")
+
+
+def system_uptime():
+    with open("/proc/uptime") as f:
+        return float(f.read().split()[0])
 
 
 if __name__ == "__main__":
+    # Records are written by a thread of their own, so that the control loop never waits for the log
+    setup_logging(queued=True, repeatfilter=RepeatFilter(every=10))
     if PROFILE_MEMORY:
         tracemalloc.start()
     try:
         with open(join(dirname(__file__), "version")) as f_version:
             version = f_version.readline()
-        print("\n\n****************************************\n")
-        print(f"Running generator_ramp.py \t{version}", flush=True)
-        print("\n****************************************\n\n")
-        print("Waiting 5s for system to startup", flush=True)
-        sleep(5)
-        print("Running now!", flush=True)
+        logger.info("****************************************")
+        logger.info("Running generator_ramp.py \t%s", version)
+        logger.info("****************************************")
+        if system_uptime() < STARTUP_DELAY_MAX_UPTIME:
+            logger.info("Waiting %ss for system to startup", STARTUP_DELAY)
+            sleep(STARTUP_DELAY)
+        logger.info("Running now!")
         g = GeneratorRampController()
-        print(g)
-        g.run()  # global dbusObjects  #  # print(__file__ + " starting up")
+        logger.info("%s", g)
+        g.run()  # global dbusObjects
     except Exception as ex:
-        print("Exception Raised", flush=True)
-        print(ex, flush=True)
-        print("Restart Required, Going Down in 5s!", flush=True)
+        logger.error("Exception Raised : %s", ex)
+        logger.error("Restart Required, Going Down in 5s!")
         sleep(5)
         raise
 # # Have a mainloop, so we can send/receive asynchronous calls to and from dbus  # DBusGMainLoop(set_as_default=True)
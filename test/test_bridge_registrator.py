@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Runs the MosquittoBridgeRegistrator against a local stand-in for the VRM API server, to check
+its retries without a network connection or a VRM account.
+
+The stand-in server drops the first request, fails the second one, answers the third one only
+after a few seconds with a failure, and accepts the fourth one.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from unittest import mock
+import logging
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+try:
+	import dbus
+	import requests
+except ImportError as e:
+	raise unittest.SkipTest("needs dbus-python and requests: %s" % e)
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../velib_python'))
+import mosquitto_bridge_registrator as registrator
+from scheduler import default_scheduler
+
+SlowResponse = 3
+
+class StandInHandler(BaseHTTPRequestHandler):
+	requests = 0
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		StandInHandler.requests += 1
+		n = StandInHandler.requests
+		if n == 1:
+			# Close the connection without an answer
+			self.close_connection = True
+			return
+		if n == 3:
+			sleep(SlowResponse)
+		self.send_response(200 if n >= 4 else 500)
+		self.send_header('Content-Length', '0')
+		self.end_headers()
+
+	def log_message(self, format, *args):
+		logging.debug(format, *args)
+
+class Registrator(registrator.MosquittoBridgeRegistrator):
+	def _restart_broker(self):
+		pass
+
+class TestBridgeRegistrator(unittest.TestCase):
+	def setUp(self):
+		tmp = tempfile.mkdtemp()
+		for name, value in (
+				('LockFilePath', os.path.join(tmp, 'registrator.lock')),
+				('BridgeConfigPath', os.path.join(tmp, 'vrm_bridge.conf')),
+				('MqttPasswordFile', os.path.join(tmp, 'mqtt_password.txt')),
+				('MosquittoConfig', os.path.join(tmp, 'mosquitto.conf')),
+				('RetryMinInterval', 0.2),
+				('get_setting', lambda path: 1)):
+			patcher = mock.patch.object(registrator, name, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+		StandInHandler.requests = 0
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.addCleanup(self.server.server_close)
+		self.addCleanup(self.server.shutdown)
+
+	def test_retries(self):
+		# Measures how late the shared scheduler runs another timer
+		gaps = []
+		last = [monotonic()]
+		def probe():
+			now = monotonic()
+			gaps.append(now - last[0])
+			last[0] = now
+			return True
+		timer = default_scheduler().schedule(probe, 0.05)
+		self.addCleanup(timer.cancel)
+
+		r = Registrator('0123456789ab', api_server='http://127.0.0.1:%d' % self.server.server_port,
+			ca_bundle=False)
+		r.register()
+		end = monotonic() + 30
+		while r._init_broker_timer is not None and monotonic() < end:
+			sleep(0.1)
+		r.abort_gracefully()
+
+		# Every attempt is exactly one request, the http adapter doesn't retry by itself
+		self.assertEqual(StandInHandler.requests, 4)
+		# A slow server doesn't hold up the other timers of the process
+		self.assertLess(max(gaps), 1)
+		with open(registrator.BridgeConfigPath) as f:
+			self.assertIn('GXdbus', f.read())
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Tests the lifecycle of VeDbusItemImport and its root trackers.
+
+Importers are created and dropped 10^5 times, as a process does that reconnects to a service each
+time it leaves and comes back, to check that neither the memory use nor the number of signal matches
+grows. The importers are closed, garbage collected, or invalidated because their service left.
+
+A fake bus stands in for the dbus. It keeps the signal matches that are added, and not removed yet,
+so no dbus daemon or other services are needed. GLib is needed to seed the non-blocking importers.
+"""
+import gc
+import os
+import sys
+import tracemalloc
+import unittest
+
+try:
+	import dbus
+	from gi.repository import GLib
+except ImportError as e:
+	raise unittest.SkipTest("needs dbus-python and GLib: %s" % e)
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '../velib_python'))
+from vedbus import VeDbusItemImport
+
+Service = 'com.victronenergy.vebus.ttyS2'
+Items = {'/Mode': {'Value': 3, 'Text': '3'}, '/Ac/In/1/CurrentLimit': {'Value': 16.0, 'Text': '16A'}}
+
+class FakeMatch(object):
+	def __init__(self, bus, handler, kwargs):
+		self._bus = bus
+		self.handler = handler
+		self.kwargs = kwargs
+		bus.matches.append(self)
+
+	def remove(self):
+		if self._bus is not None:
+			self._bus.matches.remove(self)
+			self._bus = None
+
+class FakeProxy(object):
+	def GetValue(self, reply_handler=None, error_handler=None, **kwargs):
+		if reply_handler is None:
+			return 3
+		reply_handler(3)
+
+class FakeBus(object):
+	def __init__(self):
+		self.matches = []
+
+	def get_object(self, serviceName, path, introspect=True, follow_name_owner_changes=False):
+		return FakeProxy()
+
+	def add_signal_receiver(self, handler, **kwargs):
+		return FakeMatch(self, handler, kwargs)
+
+	def call_async(self, bus_name, object_path, dbus_interface, method, signature, args,
+			reply_handler, error_handler, **kwargs):
+		reply_handler(Items)
+
+	def name_owner_changed(self, name, oldowner, newowner):
+		for m in list(self.matches):
+			if m.kwargs.get('signal_name') == 'NameOwnerChanged' and m.kwargs.get('arg0') == name:
+				m.handler(name, oldowner, newowner)
+
+def pump():
+	context = GLib.MainContext.default()
+	while context.iteration(False):
+		pass
+
+# The root trackers are created on the bus of the first importer, so all tests share one
+bus = FakeBus()
+
+class TestImporterLifecycle(unittest.TestCase):
+	def setUp(self):
+		self.bus = bus
+		self.assertEqual(len(bus.matches), 0)
+
+	def tearDown(self):
+		VeDbusItemImport._roots.clear()
+
+	def create(self, callback=None):
+		mode = VeDbusItemImport(self.bus, Service, '/Mode', callback, blocking=False)
+		limit = VeDbusItemImport(self.bus, Service, '/Ac/In/1/CurrentLimit', blocking=False)
+		pump()
+		self.assertTrue(mode.ready)
+		self.assertEqual(mode.get_value(), 3)
+		self.assertEqual(limit.get_value(), 16.0)
+		return mode, limit
+
+	def test_service_gone(self):
+		changes = []
+		mode, limit = self.create(lambda service, path, c: changes.append(c['Value']))
+		# A tracker has matches for ItemsChanged, PropertiesChanged and NameOwnerChanged
+		self.assertEqual(len(self.bus.matches), 3)
+
+		self.bus.name_owner_changed(Service, ':1.5', '')
+		self.assertEqual(len(self.bus.matches), 0)
+		self.assertEqual(len(VeDbusItemImport._roots), 0)
+		self.assertIsNone(mode.get_value())
+		self.assertIsNone(limit.get_value())
+		self.assertEqual(changes, [None])
+
+		# Closing an invalidated importer is harmless
+		mode.close()
+		limit.close()
+		self.assertEqual(len(self.bus.matches), 0)
+
+	def test_reconnect(self):
+		cycles = 100000
+		warmup = 1000
+		maxmatches = 0
+
+		tracemalloc.start()
+		try:
+			for n in range(cycles):
+				if n == warmup:
+					gc.collect()
+					start = tracemalloc.get_traced_memory()[0]
+				mode, limit = self.create()
+				maxmatches = max(maxmatches, len(self.bus.matches))
+				if n % 3 == 0:
+					mode.close()
+					limit.close()
+				elif n % 3 == 1:
+					self.bus.name_owner_changed(Service, ':1.5', '')
+				del mode, limit
+				self.assertEqual(len(self.bus.matches), 0)
+				self.assertEqual(len(VeDbusItemImport._roots), 0)
+
+			gc.collect()
+			growth = tracemalloc.get_traced_memory()[0] - start
+		finally:
+			tracemalloc.stop()
+
+		self.assertEqual(maxmatches, 3)
+		self.assertLess(growth, 64 * 1024)
+
+if __name__ == "__main__":
+	unittest.main()
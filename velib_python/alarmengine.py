@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## @package alarmengine
+# Rule based alarms on top of DbusMonitor.
+#
+# Each AlarmRule watches one service/path combo. Rules are indexed by that
+# combo, and only evaluated when DbusMonitor reports a change of it through its
+# valueChangedCallback. Timers are only used for rules with a minimum duration,
+# and to let flapping alarms expire. Alarm levels can be published on a
+# VeDbusService, one path per rule.
+#
+# Example:
+#	engine = AlarmEngine(service=dbusservice)
+#	monitor = DbusMonitor(tree, valueChangedCallback=engine.value_changed,
+#		deviceAddedCallback=engine.device_added, deviceRemovedCallback=engine.device_removed)
+#	engine.monitor = monitor
+#	engine.add_rule(AlarmRule('BmsChargeLimit', 'com.victronenergy.battery.socketcan_vecan0',
+#		'/Info/MaxChargeCurrent', '<=', 0, hysteresis=1, duration=5))
+
+from gi.repository import GLib
+import logging
+from collections import defaultdict, deque
+from time import monotonic
+
+# our own packages
+from ve_utils import exit_on_error
+
+logger = logging.getLogger(__name__)
+
+# Alarm levels, the same as used on the /Alarms/* paths of Victron services
+ALARM_OK = 0
+ALARM_WARNING = 1
+ALARM_ALARM = 2
+
+class AlarmRule(object):
+	## Constructor
+	# @param name			name of the alarm, also used for the exported path
+	# @param serviceName	the dbus-service-name, for example 'com.victronenergy.vebus.ttyS2'
+	# @param path			the object-path, for example '/Ac/ActiveIn/L1/I'
+	# @param condition		one of '>', '>=', '<', '<=', '==', '!=' to compare the value with the
+	#						threshold, or 'flapping' to raise the alarm when the value changed at least
+	#						threshold times within window seconds.
+	# @param hysteresis		how far the value must move back past the threshold to clear the alarm
+	# @param duration		seconds the condition must hold before the alarm is raised
+	# @param level			level of the alarm when raised, ALARM_WARNING or ALARM_ALARM
+	# @param alarmoninvalid	whether an invalid value (None) raises the alarm
+	def __init__(self, name, serviceName, path, condition, threshold, hysteresis=0, duration=0,
+			level=ALARM_ALARM, window=None, alarmoninvalid=False):
+		self.name = name
+		self.serviceName = serviceName
+		self.path = path
+		self.condition = condition
+		self.threshold = threshold
+		self.hysteresis = hysteresis
+		self.duration = duration
+		self.level = level
+		self.window = window
+		self.alarmoninvalid = alarmoninvalid
+
+		self.active = False
+		self._timer = None
+		self._changes = None
+		self._last = None
+
+		if condition == 'flapping':
+			if not window:
+				raise ValueError("A flapping rule needs a window")
+			self._changes = deque()
+			self._raise = self._flapping
+			self._clear = self._not_flapping
+		else:
+			self._raise, self._clear = self._compile(condition, threshold, hysteresis)
+
+	@staticmethod
+	def _compile(condition, threshold, hysteresis):
+		""" Returns a pair of functions, deciding on a valid value if the alarm
+		    must be raised, and if a raised alarm must be cleared. """
+		if condition == '>':
+			return (lambda v: v > threshold), (lambda v: v <= threshold - hysteresis)
+		if condition == '>=':
+			return (lambda v: v >= threshold), (lambda v: v < threshold - hysteresis)
+		if condition == '<':
+			return (lambda v: v < threshold), (lambda v: v >= threshold + hysteresis)
+		if condition == '<=':
+			return (lambda v: v <= threshold), (lambda v: v > threshold + hysteresis)
+		if condition == '==':
+			return (lambda v: v == threshold), (lambda v: v != threshold)
+		if condition == '!=':
+			return (lambda v: v != threshold), (lambda v: v == threshold)
+		raise ValueError("Unknown condition %s" % condition)
+
+	def _expire(self, now):
+		while self._changes and now - self._changes[0] > self.window:
+			self._changes.popleft()
+
+	def _flapping(self, v):
+		now = monotonic()
+		if v != self._last:
+			self._changes.append(now)
+		self._last = v
+		self._expire(now)
+		return len(self._changes) >= self.threshold
+
+	def _not_flapping(self, v):
+		return not self._flapping(v)
+
+	def raises(self, v):
+		if v is None and self.condition != 'flapping':
+			return self.alarmoninvalid
+		return self._raise(v)
+
+	def clears(self, v):
+		if v is None and self.condition != 'flapping':
+			return not self.alarmoninvalid
+		return self._clear(v)
+
+	# Seconds until the oldest change leaves the window, so a flapping alarm
+	# can be cleared once things calm down.
+	def expires_in(self):
+		if not self._changes:
+			return None
+		return max(0, self.window - (monotonic() - self._changes[0]))
+
+class AlarmEngine(object):
+	## Constructor
+	# @param monitor		DbusMonitor used to fetch the initial values of new rules. Can also be set
+	#						later through the monitor attribute.
+	# @param service		VeDbusService to publish the alarm levels on, under prefix/<rule name>
+	# @param alarmCallback	function that is called with the rule name and the new level when an alarm
+	#						is raised or cleared
+	def __init__(self, monitor=None, service=None, prefix='/Alarms', alarmCallback=None):
+		self.monitor = monitor
+		self.alarmCallback = alarmCallback
+		self._service = service
+		self._prefix = prefix.rstrip('/')
+		self._rules = {}
+
+		# Rules indexed by the service/path combo they depend on
+		self._index = defaultdict(list)
+
+	def add_rule(self, rule):
+		if rule.name in self._rules:
+			raise ValueError("Duplicate alarm rule %s" % rule.name)
+
+		self._rules[rule.name] = rule
+		self._index[(rule.serviceName, rule.path)].append(rule)
+		if self._service is not None:
+			self._service.add_path(self._prefix + '/' + rule.name, ALARM_OK)
+
+		if self.monitor is not None:
+			self._evaluate(rule, self.monitor.get_value(rule.serviceName, rule.path))
+
+	def remove_rule(self, name):
+		rule = self._rules.pop(name)
+		self._index[(rule.serviceName, rule.path)].remove(rule)
+		self._cancel_timer(rule)
+		if self._service is not None:
+			del self._service[self._prefix + '/' + rule.name]
+
+	def get_alarms(self):
+		""" Returns a dictionary with the levels of the active alarms, by rule name. """
+		return { name: rule.level for name, rule in self._rules.items() if rule.active }
+
+	# To be passed as, or called from, the valueChangedCallback of DbusMonitor
+	def value_changed(self, serviceName, objectPath, options, changes, deviceInstance):
+		rules = self._index.get((serviceName, objectPath), None)
+		if not rules:
+			return
+
+		v = changes['Value']
+		for rule in rules:
+			self._evaluate(rule, v)
+
+	# To be passed as, or called from, the deviceAddedCallback of DbusMonitor
+	def device_added(self, serviceName, deviceInstance):
+		if self.monitor is None:
+			return
+		for rule in self._rules.values():
+			if rule.serviceName == serviceName:
+				self._evaluate(rule, self.monitor.get_value(serviceName, rule.path))
+
+	# To be passed as, or called from, the deviceRemovedCallback of DbusMonitor
+	def device_removed(self, serviceName, deviceInstance):
+		for rule in self._rules.values():
+			if rule.serviceName == serviceName:
+				self._evaluate(rule, None)
+
+	def _evaluate(self, rule, v):
+		if rule.active:
+			if rule.clears(v):
+				self._cancel_timer(rule)
+				self._set_active(rule, False)
+			elif rule.condition == 'flapping':
+				self._start_expiry_timer(rule)
+			return
+
+		if not rule.raises(v):
+			self._cancel_timer(rule)
+		elif not rule.duration:
+			self._set_active(rule, True)
+		elif rule._timer is None:
+			rule._timer = GLib.timeout_add(int(rule.duration * 1000),
+				exit_on_error, self._duration_elapsed, rule)
+
+	def _duration_elapsed(self, rule):
+		rule._timer = None
+		self._set_active(rule, True)
+		return False
+
+	def _start_expiry_timer(self, rule):
+		self._cancel_timer(rule)
+		timeout = rule.expires_in()
+		if timeout is not None:
+			rule._timer = GLib.timeout_add(int(timeout * 1000) + 1,
+				exit_on_error, self._expired, rule)
+
+	def _expired(self, rule):
+		rule._timer = None
+		rule._expire(monotonic())
+		if len(rule._changes) < rule.threshold:
+			self._set_active(rule, False)
+		else:
+			self._start_expiry_timer(rule)
+		return False
+
+	def _cancel_timer(self, rule):
+		if rule._timer is not None:
+			GLib.source_remove(rule._timer)
+			rule._timer = None
+
+	def _set_active(self, rule, active):
+		rule.active = active
+		level = rule.level if active else ALARM_OK
+		logger.info("Alarm %s %s" % (rule.name, "raised" if active else "cleared"))
+
+		if rule.condition == 'flapping' and active:
+			self._start_expiry_timer(rule)
+
+		if self._service is not None:
+			self._service[self._prefix + '/' + rule.name] = level
+
+		if self.alarmCallback is not None:
+			self.alarmCallback(rule.name, level)
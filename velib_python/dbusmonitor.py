@@ -25,6 +25,8 @@ import argparse
 import pprint
 import traceback
 import os
+import json
+from time import time
 from collections import defaultdict
 from functools import partial
 
@@ -58,10 +60,15 @@ class Service(object):
 		super(Service, self).__init__()
 		self.id = id
 		self.name = serviceName
+		self._service_class = '.'.join(serviceName.split('.')[:3])
 		self.paths = {}
 		self._seen = set()
 		self.deviceInstance = deviceInstance
 
+		# None for a service found on the dbus. For a service restored from the
+		# warm-start cache, the time at which its values were stored.
+		self.stale = None
+
 	# For legacy code, attributes can still be accessed as if keys from a
 	# dictionary.
 	def __setitem__(self, key, value):
@@ -77,20 +84,45 @@ class Service(object):
 
 	@property
 	def service_class(self):
-		return '.'.join(self.name.split('.')[:3])
+		return self._service_class
+
+class ValuesSpec(object):
+	""" A precompiled list of (serviceName, objectPath) pairs, for use with
+	    DbusMonitor.get_values. The monitored values are resolved once, and
+	    only resolved again after services were added or removed. """
+	def __init__(self, items):
+		super(ValuesSpec, self).__init__()
+		self.items = tuple((str(s), str(p)) for s, p in items)
+		self._values = ()
+		self._layout = None
+
+	def __len__(self):
+		return len(self.items)
+
+	def __iter__(self):
+		return iter(self.items)
 
 class DbusMonitor(object):
 	## Constructor
 	def __init__(self, dbusTree, valueChangedCallback=None, deviceAddedCallback=None,
-					deviceRemovedCallback=None, namespace="com.victronenergy", ignoreServices=[]):
+					deviceRemovedCallback=None, namespace="com.victronenergy", ignoreServices=[],
+					cachefile=None, cacheinterval=60):
 		# valueChangedCallback is the callback that we call when something has changed.
 		# def value_changed_on_dbus(dbusServiceName, dbusPath, options, changes, deviceInstance):
 		# in which changes is a tuple with GetText() and GetValue()
+		#
+		# cachefile enables the warm-start cache: the list of services, their device
+		# instances and the monitored values are stored in that file every cacheinterval
+		# seconds. On startup the stored services are available immediately, marked
+		# as stale (see is_stale), while the dbus is scanned from the mainloop.
+		# Typically the file is put on a tmpfs, such as /run, so that it survives a
+		# restart of the process but not a reboot.
 		self.valueChangedCallback = valueChangedCallback
 		self.deviceAddedCallback = deviceAddedCallback
 		self.deviceRemovedCallback = deviceRemovedCallback
 		self.dbusTree = dbusTree
 		self.ignoreServices = ignoreServices
+		self._ignorePrefixes = tuple(ignoreServices)
 
 		# Lists all tracked services. Stores name, id, device instance, value per path, and whenToLog info
 		# indexed by service name (eg. com.victronenergy.settings).
@@ -99,12 +131,29 @@ class DbusMonitor(object):
 		# Same values as self.servicesByName, but indexed by service id (eg. :1.30)
 		self.servicesById = {}
 
-		# Keep track of services by class to speed up calls to get_service_list
-		self.servicesByClass = defaultdict(list)
+		# Keep track of services by class to speed up calls to get_service_list,
+		# indexed by class and then by service name.
+		self.servicesByClass = {}
+
+		# Results of get_service_list, by classfilter. Cleared whenever a service
+		# is added or removed.
+		self._serviceLists = {}
 
 		# Keep track of any additional watches placed on items
 		self.serviceWatches = defaultdict(list)
 
+		# Callbacks registered with track_value, indexed by service name and
+		# then by path. All of them share the signal receivers of their service.
+		self.trackedValues = {}
+
+		# Incremented on every change of a monitored value, and when services
+		# are added or removed. See change_epoch.
+		self._epoch = 0
+
+		# Replaced whenever services are added or removed, so that a ValuesSpec
+		# knows when its resolved values must be looked up again.
+		self._layout = object()
+
 		# For a PC, connect to the SessionBus
 		# For a CCGX, connect to the SystemBus
 		self.dbusConn = SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else SystemBus()
@@ -128,12 +177,56 @@ class DbusMonitor(object):
 			signal_name='ItemsChanged', path='/',
 			sender_keyword='senderId')
 
+		self._cachefile = cachefile
+		self._cacheepoch = None
+		if cachefile is not None and self._load_cache():
+			# Serve the cached values until the scan, which is done from the
+			# mainloop, has replaced them.
+			GLib.idle_add(exit_on_error, self._scan_all, True)
+		else:
+			self._scan_all()
+
+		if cachefile is not None and cacheinterval:
+			GLib.timeout_add_seconds(cacheinterval, exit_on_error, self._save_cache_periodic)
+
+	## Scans the dbus for the services to monitor.
+	# @param notify	call deviceAddedCallback and deviceRemovedCallback for the services that
+	#				were found or are gone, as done for NameOwnerChanged, and valueChangedCallback
+	#				for the cached values that differ from the scanned ones. Used for the scan
+	#				that replaces the warm-start cache, which runs after the constructor.
+	def _scan_all(self, notify=False):
 		logger.info('===== Search on dbus for services that we will monitor starting... =====')
 		serviceNames = self.dbusConn.list_names()
 		for serviceName in serviceNames:
-			self.scan_dbus_service(serviceName)
+			serviceName = str(serviceName)
+			service = self.servicesByName.get(serviceName, None)
+			if service is not None and service.stale is None:
+				continue # Already picked up by a NameOwnerChanged
+			added = self.scan_dbus_service(serviceName)
+			if not added or not notify:
+				continue
+			if service is None:
+				if self.deviceAddedCallback is not None:
+					self.deviceAddedCallback(serviceName, self.get_device_instance(serviceName))
+			elif self.valueChangedCallback is not None:
+				# Tell about the cached values that turned out to be different
+				fresh = self.servicesByName[serviceName]
+				for path, cached in service.paths.items():
+					a = fresh.paths.get(path, None)
+					if a is not None and a.value != cached.value:
+						self._execute_value_changes(serviceName, path,
+							{'Value': a.value, 'Text': a.text}, a.options)
+
+		# Anything still stale is no longer on the dbus
+		for service in list(self.servicesByName.values()):
+			if service.stale is not None:
+				logger.info("%s from the warm-start cache is gone, removing it" % service.name)
+				self._service_gone(service, notify)
 
 		logger.info('===== Search on dbus for services that we will monitor finished =====')
+		if self._cachefile is not None:
+			self.save_cache()
+		return False
 
 	@staticmethod
 	def make_service(serviceId, serviceName, deviceInstance):
@@ -161,15 +254,17 @@ class DbusMonitor(object):
 		elif name in self.servicesByName:
 			# it disappeared, we need to remove it.
 			logger.info("%s disappeared from the dbus. Removing it from our lists" % name)
-			service = self.servicesByName[name]
-			del self.servicesById[service.id]
-			del self.servicesByName[name]
-			for watch in self.serviceWatches[name]:
-				watch.remove()
-			del self.serviceWatches[name]
-			self.servicesByClass[service.service_class].remove(service)
-			if self.deviceRemovedCallback is not None:
-				self.deviceRemovedCallback(name, service.deviceInstance)
+			self._service_gone(self.servicesByName[name])
+
+	## Removes a service that is no longer on the dbus, together with the watches on it,
+	# and calls deviceRemovedCallback if notify is set.
+	def _service_gone(self, service, notify=True):
+		self._remove_service(service)
+		for watch in self.serviceWatches.pop(service.name, ()):
+			watch.remove()
+		self.trackedValues.pop(service.name, None)
+		if notify and self.deviceRemovedCallback is not None:
+			self.deviceRemovedCallback(service.name, service.deviceInstance)
 
 	def scan_dbus_service(self, serviceName):
 		try:
@@ -191,7 +286,7 @@ class DbusMonitor(object):
 		# make it a normal string instead of dbus string
 		serviceName = str(serviceName)
 
-		if (len(self.ignoreServices) != 0 and any(serviceName.startswith(x) for x in self.ignoreServices)):
+		if self._ignorePrefixes and serviceName.startswith(self._ignorePrefixes):
 			logger.debug("Ignoring service %s" % serviceName)
 			return False
 
@@ -204,8 +299,9 @@ class DbusMonitor(object):
 		serviceId = self.dbusConn.get_name_owner(serviceName)
 
 		# we should never be notified to add a D-Bus service that we already have. If this assertion
-		# raises, check process_name_owner_changed, and D-Bus workings.
-		assert serviceName not in self.servicesByName
+		# raises, check process_name_owner_changed, and D-Bus workings. Services restored from the
+		# warm-start cache are the exception, those are replaced.
+		assert serviceName not in self.servicesByName or self.servicesByName[serviceName].stale is not None
 		assert serviceId not in self.servicesById
 
 		# Try to fetch everything with a GetItems, then fall back to older
@@ -277,9 +373,7 @@ class DbusMonitor(object):
 
 		# Adjust self at the end of the scan, so we don't have an incomplete set of
 		# data if an exception occurs during the scan.
-		self.servicesByName[serviceName] = service
-		self.servicesById[serviceId] = service
-		self.servicesByClass[service.service_class].append(service)
+		self._add_service(service)
 
 		return True
 
@@ -312,11 +406,30 @@ class DbusMonitor(object):
 				text = item.get('Text', None)
 				service.paths[path] = self.make_monitor(service, path, unwrap_dbus_value(value), unwrap_dbus_value(text), options)
 
-		self.servicesByName[serviceName] = service
-		self.servicesById[serviceId] = service
-		self.servicesByClass[service.service_class].append(service)
+		self._add_service(service)
 		return True
 
+	def _add_service(self, service):
+		self.servicesByName[service.name] = service
+		if service.id is not None:
+			self.servicesById[service.id] = service
+		self.servicesByClass.setdefault(service.service_class, {})[service.name] = service
+		self._services_changed()
+
+	def _remove_service(self, service):
+		del self.servicesByName[service.name]
+		self.servicesById.pop(service.id, None)
+		services = self.servicesByClass[service.service_class]
+		del services[service.name]
+		if not services:
+			del self.servicesByClass[service.service_class]
+		self._services_changed()
+
+	def _services_changed(self):
+		self._layout = object()
+		self._epoch += 1
+		self._serviceLists.clear()
+
 	def handler_item_changes(self, items, senderId):
 		if not isinstance(items, dict):
 			return
@@ -373,6 +486,7 @@ class DbusMonitor(object):
 
 		a.value = value
 		a.text = text
+		self._epoch += 1
 
 		# And do the rest of the processing in on the mainloop
 		if self.valueChangedCallback is not None:
@@ -405,6 +519,39 @@ class DbusMonitor(object):
 
 		return value.value
 
+	# Returns the values for a list of (servicename, path) pairs as a tuple, in
+	# the same order. The default_value is returned in the same cases as for
+	# get_value. Pass a ValuesSpec, see compile_values, to avoid resolving the
+	# pairs on every call. Since no signals are processed while this runs, the
+	# values returned are consistent with each other.
+	def get_values(self, spec, default_value=None):
+		if not isinstance(spec, ValuesSpec):
+			spec = ValuesSpec(spec)
+
+		if spec._layout is not self._layout:
+			spec._values = tuple(self._find_monitor(s, p) for s, p in spec.items)
+			spec._layout = self._layout
+
+		return tuple(default_value if v is None or v.value is None else v.value
+			for v in spec._values)
+
+	# Precompiles a list of (servicename, path) pairs for use with get_values.
+	def compile_values(self, items):
+		return ValuesSpec(items)
+
+	def _find_monitor(self, serviceName, objectPath):
+		service = self.servicesByName.get(serviceName, None)
+		if service is None:
+			return None
+		return service.paths.get(objectPath, None)
+
+	# A counter that is incremented whenever a monitored value changes, or a
+	# service is added or removed. When it is the same as on a previous call,
+	# nothing that can be returned by get_value or get_values has changed.
+	@property
+	def change_epoch(self):
+		return self._epoch
+
 	# returns if a dbus exists now, by doing a blocking dbus call.
 	# Typically seen will be sufficient and doesn't need access to the dbus.
 	def exists(self, serviceName, objectPath):
@@ -462,23 +609,141 @@ class DbusMonitor(object):
 			error_handler(TypeError('Service or path not found, '
 						'service=%s, path=%s' % (serviceName, objectPath)))
 
+	# Sets the values of several paths of a service at once, with the SetItems method on the root of
+	# the service. items is a dict with the values by path. Returns the return value of SetItems, which
+	# is 0 when all values are set, and otherwise the same as SetValue, in which case none of them are
+	# set. Returns -1 if the service or one of the paths does not exist.
+	def set_items(self, serviceName, items):
+		if self._find_items(serviceName, items) is not None:
+			return -1
+		return self.dbusConn.call_blocking(serviceName, '/',
+				   dbus_interface='com.victronenergy.BusItem',
+				   method='SetItems', signature='a{sv}',
+				   args=[self._wrap_items(items)])
+
+	# Similar to set_items, but operates asynchronously
+	def set_items_async(self, serviceName, items,
+			reply_handler=None, error_handler=None):
+		missing = self._find_items(serviceName, items)
+		if missing is None:
+			self.dbusConn.call_async(serviceName, '/',
+				dbus_interface='com.victronenergy.BusItem',
+				method='SetItems', signature='a{sv}',
+				args=[self._wrap_items(items)],
+				reply_handler=reply_handler, error_handler=error_handler)
+			return
+
+		if error_handler is not None:
+			error_handler(TypeError('Service or path not found, '
+						'service=%s, path=%s' % (serviceName, missing)))
+
+	# Returns the first path of items that the service doesn't have, or None when it has them all
+	def _find_items(self, serviceName, items):
+		service = self.servicesByName.get(serviceName, None)
+		if service is None:
+			return '/'
+		for path in items:
+			if path not in service.paths:
+				return path
+		return None
+
+	@staticmethod
+	def _wrap_items(items):
+		return dbus.Dictionary({ path: wrap_dbus_value(v) for path, v in items.items() },
+			signature='sv')
+
 	# returns a dictionary, keys are the servicenames, value the instances
 	# optionally use the classfilter to get only a certain type of services, for
 	# example com.victronenergy.battery.
+	# The result is cached until a service is added or removed, so it must not
+	# be modified by the caller.
+	# Returns a new dict each time, the caller may modify it
 	def get_service_list(self, classfilter=None):
-		if classfilter is None:
-			return { servicename: service.deviceInstance \
-				for servicename, service in self.servicesByName.items() }
+		try:
+			return dict(self._serviceLists[classfilter])
+		except KeyError:
+			pass
 
-		if classfilter not in self.servicesByClass:
-			return {}
+		if classfilter is None:
+			services = self.servicesByName
+		else:
+			services = self.servicesByClass.get(classfilter, {})
 
-		return { service.name: service.deviceInstance \
-			for service in self.servicesByClass[classfilter] }
+		r = self._serviceLists[classfilter] = { servicename: service.deviceInstance \
+			for servicename, service in services.items() }
+		return dict(r)
 
 	def get_device_instance(self, serviceName):
 		return self.servicesByName[serviceName].deviceInstance
 
+	# Returns True if the values of this service were restored from the
+	# warm-start cache, and the service was not found on the dbus yet.
+	def is_stale(self, serviceName):
+		try:
+			return self.servicesByName[serviceName].stale is not None
+		except KeyError:
+			return False
+
+	# Writes the services found on the dbus and their monitored values to the
+	# cachefile. Services that are still stale are left out.
+	def save_cache(self):
+		services = {}
+		for name, service in self.servicesByName.items():
+			if service.stale is not None:
+				continue
+			services[name] = {
+				'deviceInstance': service.deviceInstance,
+				'values': { path: [v.value, v.text] for path, v in service.paths.items() },
+				'seen': [path for path in service.paths if service.seen(path)]
+			}
+
+		data = {'timestamp': time(), 'services': services}
+		try:
+			with open(self._cachefile + '.tmp', 'w') as f:
+				json.dump(data, f)
+			os.rename(self._cachefile + '.tmp', self._cachefile)
+		except (OSError, TypeError, ValueError) as e:
+			logger.error("Failed to write warm-start cache %s: %s" % (self._cachefile, e))
+		else:
+			self._cacheepoch = self._epoch
+
+	def _save_cache_periodic(self):
+		if self._cacheepoch != self._epoch:
+			self.save_cache()
+		return True
+
+	def _load_cache(self):
+		try:
+			with open(self._cachefile) as f:
+				data = json.load(f)
+			timestamp = float(data['timestamp'])
+			services = data['services']
+		except (OSError, ValueError, TypeError, KeyError) as e:
+			logger.info("No usable warm-start cache in %s: %s" % (self._cachefile, e))
+			return False
+
+		for serviceName, cached in services.items():
+			paths = self.dbusTree.get('.'.join(serviceName.split('.')[0:3]), None)
+			if paths is None:
+				continue
+			try:
+				service = self.make_service(None, serviceName, cached['deviceInstance'])
+				values = cached['values']
+				for path, options in paths.items():
+					value, text = values.get(path, (None, None))
+					service.paths[path] = self.make_monitor(service, path, value, text, options)
+				for path in cached.get('seen', ()):
+					service.set_seen(path)
+			except (KeyError, TypeError, ValueError) as e:
+				logger.info("Ignoring %s in the warm-start cache: %s" % (serviceName, e))
+				continue
+			service.stale = timestamp
+			self._add_service(service)
+
+		logger.info("Restored %d services from the warm-start cache, %.1fs old" % (
+			len(self.servicesByName), time() - timestamp))
+		return len(self.servicesByName) > 0
+
 	def track_value(self, serviceName, objectPath, callback, *args, **kwargs):
 		""" A DbusMonitor can watch specific service/path combos for changes
 		    so that it is not fully reliant on the global handler_value_changes
@@ -486,32 +751,58 @@ class DbusMonitor(object):
 		    the service disappears from dbus. """
 		cb = partial(callback, *args, **kwargs)
 
-		def root_tracker(items):
-			# Check if objectPath in dict
+		paths = self.trackedValues.get(serviceName, None)
+		if paths is None:
+			# One ItemsChanged receiver on root for the whole service
+			paths = self.trackedValues[serviceName] = {}
+			self.serviceWatches[serviceName].append(
+				self.dbusConn.add_signal_receiver(partial(self._tracked_items_changed, paths),
+					dbus_interface='com.victronenergy.BusItem',
+					signal_name='ItemsChanged',
+					path="/", bus_name=serviceName))
+
+		callbacks = paths.get(objectPath, None)
+		if callbacks is None:
+			# And one PropertiesChanged receiver per path
+			callbacks = paths[objectPath] = []
+			self.serviceWatches[serviceName].append(
+				self.dbusConn.add_signal_receiver(partial(self._tracked_properties_changed, callbacks),
+					dbus_interface='com.victronenergy.BusItem',
+					signal_name='PropertiesChanged',
+					path=objectPath, bus_name=serviceName))
+
+		callbacks.append(cb)
+
+	@staticmethod
+	def _tracked_properties_changed(callbacks, changes):
+		for cb in callbacks:
+			cb(changes)
+
+	@staticmethod
+	def _tracked_items_changed(paths, items):
+		if not isinstance(items, dict):
+			return
+
+		for path, v in items.items():
+			# Check if path is tracked
+			callbacks = paths.get(path, None)
+			if callbacks is None:
+				continue
+
 			try:
-				v = items[objectPath]
 				_v = unwrap_dbus_value(v['Value'])
 			except (KeyError, TypeError):
-				return # not in this dict
+				continue
 
 			try:
 				t = v['Text']
 			except KeyError:
-				cb({'Value': _v })
+				changes = {'Value': _v}
 			else:
-				cb({'Value': _v, 'Text': t})
+				changes = {'Value': _v, 'Text': t}
 
-		# Track changes on the path, and also on root
-		self.serviceWatches[serviceName].extend((
-			self.dbusConn.add_signal_receiver(cb,
-				dbus_interface='com.victronenergy.BusItem',
-				signal_name='PropertiesChanged',
-				path=objectPath, bus_name=serviceName),
-			self.dbusConn.add_signal_receiver(root_tracker,
-				dbus_interface='com.victronenergy.BusItem',
-				signal_name='ItemsChanged',
-				path="/", bus_name=serviceName),
-		))
+			for cb in callbacks:
+				cb(changes)
 
 
 # ====== ALL CODE BELOW THIS LINE IS PURELY FOR DEVELOPING THIS CLASS ======
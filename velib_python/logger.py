@@ -1,8 +1,14 @@
 #!/usr/bin/python3 -u
 # -*- coding: utf-8 -*-
 
+import atexit
+from collections import OrderedDict
 import logging
+import logging.handlers
+import queue
 import sys
+import threading
+from time import monotonic
 
 class LevelFilter(logging.Filter):
 	def __init__(self, passlevels, reject):
@@ -15,9 +21,92 @@ class LevelFilter(logging.Filter):
 		else:
 			return (record.levelno in self.passlevels)
 
+# Suppresses records that repeat the previous message of the same key. Every so many repeats, and/or
+# once per interval seconds, a repeat is let through anyway. The key is the repeatkey attribute of
+# the record, set with extra={'repeatkey': ...}, or else the logger name and the message format.
+# Only the maxkeys most recently used keys are remembered, so messages that are formatted before
+# they are logged, and thus have a different key each time, can't make it grow without bound.
+class RepeatFilter(logging.Filter):
+	def __init__(self, every=None, interval=None, maxkeys=100):
+		self.every = every
+		self.interval = interval
+		self.maxkeys = maxkeys
+		self._last = OrderedDict()
+		self._lock = threading.Lock()
+
+	def filter(self, record):
+		key = getattr(record, 'repeatkey', None)
+		if key is None:
+			key = (record.name, record.msg)
+		message = record.getMessage()
+		now = monotonic()
+
+		with self._lock:
+			last = self._last.get(key)
+			if last is None or last[0] != message:
+				self._last[key] = [message, 0, now]
+				self._last.move_to_end(key)
+				if len(self._last) > self.maxkeys:
+					self._last.popitem(last=False)
+				return True
+			self._last.move_to_end(key)
+
+			last[1] += 1
+			if (self.every is not None and last[1] % self.every == 0) or \
+					(self.interval is not None and now - last[2] >= self.interval):
+				last[2] = now
+				return True
+			return False
+
+# Puts records on a bounded queue, for a QueueListener to write them from another thread, so that
+# logging never waits for the output. It never blocks either: when the queue is nearly full, records
+# below reservelevel are dropped, to keep the last reserve places for the more important ones. When
+# it is completely full, all records are dropped. Dropped records are counted, by level, and reported
+# with the next record that fits.
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+	def __init__(self, maxsize=1000, reserve=100, reservelevel=logging.WARNING):
+		logging.handlers.QueueHandler.__init__(self, queue.Queue(maxsize))
+		self.maxsize = maxsize
+		self.reserve = reserve
+		self.reservelevel = reservelevel
+		self.dropped = {}
+		self._unreported = 0
+		self.listener = None
+
+	def enqueue(self, record):
+		q = self.queue
+		if record.levelno < self.reservelevel and q.qsize() >= self.maxsize - self.reserve:
+			self._drop(record)
+			return
+
+		if self._unreported:
+			# Needs an extra place, leave it to the next record if there is none
+			if q.qsize() < self.maxsize - 1:
+				count, self._unreported = self._unreported, 0
+				q.put_nowait(logging.makeLogRecord({'name': record.name, 'levelno': logging.WARNING,
+					'levelname': 'WARNING', 'msg': 'Dropped %d log records' % count}))
+
+		try:
+			q.put_nowait(record)
+		except queue.Full:
+			self._drop(record)
+
+	def _drop(self, record):
+		self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+		self._unreported += 1
+
+	def close(self):
+		logging.handlers.QueueHandler.close(self)
+		if self.listener is not None:
+			self.listener.stop()
+			self.listener = None
+
 # Leave the name set to None to get the root logger. For some reason specifying 'root' has a
 # different effect: there will be two root loggers, both with their own handlers...
-def setup_logging(debug=False, name=None):
+#
+# When queued is True, the records are written by a thread of their own, see DroppingQueueHandler.
+# repeatfilter is an optional RepeatFilter, applied before the records are queued.
+def setup_logging(debug=False, name=None, queued=False, maxqueue=1000, repeatfilter=None):
 	formatter = logging.Formatter(fmt='%(levelname)s:%(module)s:%(message)s')
 
 	# Make info and debug stream to stdout and the rest to stderr
@@ -30,8 +119,21 @@ def setup_logging(debug=False, name=None):
 	h2.setFormatter(formatter)
 
 	logger = logging.getLogger(name)
-	logger.addHandler(h1)
-	logger.addHandler(h2)
+	if queued:
+		handler = DroppingQueueHandler(maxqueue, reserve=maxqueue // 10)
+		handler.listener = logging.handlers.QueueListener(handler.queue, h1, h2, respect_handler_level=True)
+		handler.listener.start()
+		# Write what is still queued at exit
+		atexit.register(handler.close)
+		if repeatfilter is not None:
+			handler.addFilter(repeatfilter)
+		logger.addHandler(handler)
+	else:
+		if repeatfilter is not None:
+			h1.addFilter(repeatfilter)
+			h2.addFilter(repeatfilter)
+		logger.addHandler(h1)
+		logger.addHandler(h2)
 
 	# Set the loglevel and show it
 	logger.setLevel(level=(logging.DEBUG if debug else logging.INFO))
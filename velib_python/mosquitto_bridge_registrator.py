@@ -6,9 +6,11 @@ import threading
 import logging
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import subprocess
 import traceback
 from ve_utils import exit_on_error
+from scheduler import default_scheduler
 VrmNumberOfBrokers = 128
 VrmApiServer = 'https://ccgxlogging.victronenergy.com'
 CaBundlePath = "/etc/ssl/certs/ccgx-ca.pem"
@@ -55,6 +57,12 @@ bridge {{
 
 LockFilePath = "/run/mosquittobridgeregistrator.lock"
 
+# Failed registrations are retried after RetryMinInterval seconds, doubling up to RetryMaxInterval. Each
+# wait is randomized between half and the full interval, so that devices that lost their connection at
+# the same time don't all retry at the same time.
+RetryMinInterval = 15
+RetryMaxInterval = 15 * 60
+
 
 def get_setting(path):
 	"""Throwing exceptions on fail is desired."""
@@ -66,24 +74,29 @@ def get_setting(path):
 	answer = reply.get_args_list()[0].real
 	return answer
 
-class RepeatingTimer(threading.Thread):
-	def __init__(self, callback, interval):
-		threading.Thread.__init__(self)
-		self.event = threading.Event()
+# Calls callback right away, and then every interval seconds until it returns False or the timer is
+# stopped. All timers share the thread of the default scheduler, instead of having a thread each.
+class RepeatingTimer(object):
+	def __init__(self, callback, interval, scheduler=None):
 		self.callback = callback
 		self.interval = interval
+		self._scheduler = scheduler or default_scheduler()
+		self._timer = None
 
-	def run(self):
-		while not self.event.is_set():
-			if not self.callback():
-				self.event.set()
-
-			# either call your function here,
-			# or put the body of the function here
-			self.event.wait(self.interval)
+	def start(self):
+		self._timer = self._scheduler.schedule(self.callback, self.interval, delay=0)
 
 	def stop(self):
-		self.event.set()
+		if self._timer is not None:
+			self._timer.cancel()
+
+	# Waits until the callback is not called anymore, and is not running
+	def join(self, timeout=None):
+		if self._timer is not None:
+			self._timer.wait(timeout)
+
+	def is_alive(self):
+		return self._timer is not None and not self._timer.done.is_set()
 
 
 class MosquittoBridgeRegistrator(object):
@@ -98,10 +111,19 @@ class MosquittoBridgeRegistrator(object):
 	and instead connect directly to the VRM broker url.
 	"""
 
-	def __init__(self, system_id):
+	## Constructor
+	# @param system_id	the VRM portal id
+	# @param api_server	url of the VRM API server, for example to test against a local server
+	# @param ca_bundle	CA bundle to verify the API server with, or False to not verify it
+	def __init__(self, system_id, api_server=VrmApiServer, ca_bundle=CaBundlePath):
 		self._init_broker_timer = None
+		self._retry_thread = None
 		self._aborted = threading.Event()
 		self._system_id = system_id
+		self._api_server = api_server
+		self._ca_bundle = ca_bundle
+		self._session = None
+		self._retries = 0
 		self._global_broker_username = "ccgxapikey_" + self._system_id
 		self._global_broker_password = None
 		self._requests_log_level = logging.getLogger("requests").getEffectiveLevel()
@@ -183,15 +205,54 @@ class MosquittoBridgeRegistrator(object):
 			if not self._aborted.is_set():
 				logging.info("[InitBroker] Registration failed. Retrying in thread, silently.")
 				logging.getLogger("requests").setLevel(logging.WARNING)
-				# Not using gobject to keep these blocking operations out of the event loop
-				self._init_broker_timer = RepeatingTimer(self._init_broker, 60)
-				self._init_broker_timer.start()
+				self._schedule_retry()
 
 	def abort_gracefully(self):
 		self._aborted.set()
-		if self._init_broker_timer:
-			self._init_broker_timer.stop()
-			self._init_broker_timer.join()
+		timer = self._init_broker_timer
+		if timer:
+			timer.cancel()
+			timer.wait()
+		thread = self._retry_thread
+		if thread is not None:
+			thread.join()
+		if self._session is not None:
+			self._session.close()
+			self._session = None
+
+	# Not using gobject to keep these blocking operations out of the event loop. The shared
+	# scheduler only starts the attempts, which are run on a thread of their own, so that a slow
+	# server doesn't hold up the other timers of the process.
+	def _schedule_retry(self):
+		interval = min(RetryMaxInterval, RetryMinInterval * 2 ** self._retries)
+		self._retries += 1
+		self._init_broker_timer = default_scheduler().schedule(self._start_retry, interval,
+			delay=interval / 2, jitter=interval / 2, repeat=False)
+
+	def _start_retry(self):
+		if self._aborted.is_set():
+			return
+		self._retry_thread = threading.Thread(target=self._retry, name='bridge-registration', daemon=True)
+		self._retry_thread.start()
+
+	def _retry(self):
+		if self._aborted.is_set():
+			return
+		if self._init_broker():
+			if not self._aborted.is_set():
+				self._schedule_retry()
+
+	# The session is kept, so that retries can reuse the connection to the server. The adapters
+	# don't retry by themselves, all retries are done, and backed off, by _schedule_retry.
+	def _get_session(self):
+		if self._session is None:
+			session = requests.Session()
+			session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+			session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+			session.headers.update({'content-type': 'application/x-www-form-urlencoded', 'User-Agent': 'dbus-mqtt'})
+			session.verify = self._ca_bundle
+			self._session = session
+		return self._session
 
 	def _write_config_atomically(self, path, contents):
 
@@ -222,7 +283,13 @@ class MosquittoBridgeRegistrator(object):
 	def _init_broker(self, quiet=True, timeout=5):
 		try:
 			with open(LockFilePath, "a") as lockFile:
-				fcntl.flock(lockFile, fcntl.LOCK_EX)
+				# Don't wait for another registrator, try again later instead
+				try:
+					fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except BlockingIOError:
+					if not quiet:
+						logging.info('[InitBroker] Another registration is in progress')
+					return True
 
 				orig_config = None
 				# Read the current config file (if present)
@@ -242,48 +309,45 @@ class MosquittoBridgeRegistrator(object):
 				# Get to the actual registration
 				if not quiet:
 					logging.info('[InitBroker] Registering CCGX at VRM portal')
-				with requests.Session() as session:
-					headers = {'content-type': 'application/x-www-form-urlencoded', 'User-Agent': 'dbus-mqtt'}
-					r = session.post(
-						VrmApiServer + '/log/storemqttpassword.php',
-						data=dict(identifier=self._global_broker_username, mqttPassword=self._global_broker_password),
-						headers=headers,
-						verify=CaBundlePath,
-						timeout=(timeout,timeout))
-					if r.status_code == requests.codes.ok:
-						vrm_portal_mode = get_setting('/Settings/Network/VrmPortal')
-
-						config_rpc = ""
-						config_dbus = ""
-
-						if vrm_portal_mode == 2:
-							config_rpc = BridgeSettingsRPC.format(self._system_id,
-								self._global_broker_password,
-								self._get_vrm_broker_url(), RpcBroker, CaBundlePath,
-								self._global_broker_username)
-						if vrm_portal_mode >= 1:
-							config_dbus = BridgeSettingsDbus.format(self._system_id,
-								self._global_broker_password,
-								self._get_vrm_broker_url(), RpcBroker, CaBundlePath,
-								self._global_broker_username)
-
-						config = "# Generated by BridgeRegistrator. Any changes will be overwritten on service start.\n"
-						config += config_rpc
-						config += config_dbus
-						# Do we need to adjust the settings file?
-						if config != orig_config:
-							logging.info('[InitBroker] Writing new config file')
-							self._write_config_atomically(BridgeConfigPath, config)
-							self._restart_broker()
-						else:
-							logging.info('[InitBroker] Not updating config file and not restarting FlashMQ, because config is correct.')
-						self._init_broker_timer = None
-						logging.getLogger("requests").setLevel(self._requests_log_level)
-						logging.info('[InitBroker] Registration successful')
-						return False
-					if not quiet:
-						logging.error('VRM registration failed. Http status was: {}'.format(r.status_code))
-						logging.error('Message was: {}'.format(r.text))
+				r = self._get_session().post(
+					self._api_server + '/log/storemqttpassword.php',
+					data=dict(identifier=self._global_broker_username, mqttPassword=self._global_broker_password),
+					timeout=(timeout,timeout))
+				if r.status_code == requests.codes.ok:
+					vrm_portal_mode = get_setting('/Settings/Network/VrmPortal')
+
+					config_rpc = ""
+					config_dbus = ""
+
+					if vrm_portal_mode == 2:
+						config_rpc = BridgeSettingsRPC.format(self._system_id,
+							self._global_broker_password,
+							self._get_vrm_broker_url(), RpcBroker, CaBundlePath,
+							self._global_broker_username)
+					if vrm_portal_mode >= 1:
+						config_dbus = BridgeSettingsDbus.format(self._system_id,
+							self._global_broker_password,
+							self._get_vrm_broker_url(), RpcBroker, CaBundlePath,
+							self._global_broker_username)
+
+					config = "# Generated by BridgeRegistrator. Any changes will be overwritten on service start.\n"
+					config += config_rpc
+					config += config_dbus
+					# Do we need to adjust the settings file?
+					if config != orig_config:
+						logging.info('[InitBroker] Writing new config file')
+						self._write_config_atomically(BridgeConfigPath, config)
+						self._restart_broker()
+					else:
+						logging.info('[InitBroker] Not updating config file and not restarting FlashMQ, because config is correct.')
+					self._init_broker_timer = None
+					self._retries = 0
+					logging.getLogger("requests").setLevel(self._requests_log_level)
+					logging.info('[InitBroker] Registration successful')
+					return False
+				if not quiet:
+					logging.error('VRM registration failed. Http status was: {}'.format(r.status_code))
+					logging.error('Message was: {}'.format(r.text))
 		except:
 			if not quiet:
 				traceback.print_exc()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+## @package scheduler
+# Runs timed and periodic callbacks of a whole process from a single thread.
+#
+# The timers are kept on a heap ordered by the time they are due, so the thread only
+# wakes up when the first timer is due, or when a timer is added that is due before
+# that. Timers that are due within the slack of the scheduler are run in the same
+# wakeup.
+#
+# Example:
+#	timer = default_scheduler().schedule(save_state, 60, jitter=5)
+#	...
+#	timer.cancel()
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+class Timer(object):
+	""" Handle of a scheduled callback, returned by Scheduler.schedule. """
+	def __init__(self, scheduler, callback, args, interval, repeat, jitter):
+		self.callback = callback
+		self.args = args
+		self.interval = interval
+		self.repeat = repeat
+		self.jitter = jitter
+		self.due = None
+		self._base = None  # due time without the jitter
+		self.cancelled = False
+		self.running = False
+		self.queued = False  # on the heap of the scheduler
+
+		# Set once the callback will not be called anymore, and is not running
+		self.done = threading.Event()
+		self._scheduler = scheduler
+
+	def cancel(self):
+		self._scheduler._cancel(self)
+
+	def wait(self, timeout=None):
+		return self.done.wait(timeout)
+
+class Scheduler(object):
+	## Constructor
+	# @param slack	seconds a timer may be run early, to run it in the same wakeup as an
+	#				earlier timer.
+	# @param name	name of the thread
+	def __init__(self, slack=0.01, name='scheduler'):
+		self.slack = slack
+		self._name = name
+		self._heap = []
+		self._cancelled = 0  # cancelled timers that are still on the heap
+		self._seq = itertools.count()  # keeps timers with the same due time in order
+		self._condition = threading.Condition()
+		self._thread = None
+		self._stopped = False
+
+		# Statistics about how late the callbacks were run, see stats()
+		self._fired = 0
+		self._late = 0
+		self._totallateness = 0.0
+		self._maxlateness = 0.0
+
+	## Schedules a callback.
+	# @param callback	function to call, with args, on the scheduler thread. When repeat is
+	#					True, the timer stops when it returns something that is not true, as
+	#					with GLib.timeout_add.
+	# @param interval	seconds between the calls.
+	# @param delay		seconds until the first call, defaults to interval.
+	# @param repeat		call the function every interval seconds, or only once.
+	# @param jitter		a random delay of up to jitter seconds is added to each call, to prevent
+	#					many processes or timers from running at the same moment.
+	# @return Timer		handle to cancel the timer with.
+	def schedule(self, callback, interval, delay=None, repeat=True, jitter=0, args=()):
+		timer = Timer(self, callback, args, interval, repeat, jitter)
+		with self._condition:
+			if self._stopped:
+				raise RuntimeError("Scheduler %s has been stopped" % self._name)
+			self._push(timer, monotonic() + (interval if delay is None else delay))
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+				self._thread.start()
+		return timer
+
+	## Returns a dict with the number of callbacks run, how many of those were run more than
+	# the slack late, and the mean and maximum lateness in seconds.
+	def stats(self):
+		with self._condition:
+			return {
+				'fired': self._fired,
+				'late': self._late,
+				'meanlateness': self._totallateness / self._fired if self._fired else 0.0,
+				'maxlateness': self._maxlateness,
+			}
+
+	## Cancels all timers and stops the thread, after the callback that is running, if any.
+	def stop(self):
+		with self._condition:
+			self._stopped = True
+			for _, _, timer in self._heap:
+				timer.cancelled = True
+				timer.queued = False
+				timer.done.set()
+			self._heap = []
+			self._cancelled = 0
+			self._condition.notify()
+			thread = self._thread
+		if thread is not None and thread is not threading.current_thread():
+			thread.join()
+
+	def _push(self, timer, due):
+		timer._base = due
+		if timer.jitter:
+			due += random.uniform(0, timer.jitter)
+		timer.due = due
+		timer.queued = True
+		first = not self._heap or due < self._heap[0][0]
+		heapq.heappush(self._heap, (due, next(self._seq), timer))
+		if first:
+			self._condition.notify()
+
+	def _cancel(self, timer):
+		with self._condition:
+			if timer.queued and not timer.cancelled:
+				self._cancelled += 1
+			timer.cancelled = True
+			if not timer.running:
+				timer.done.set()
+			# Left on the heap, and dropped when it is due, as that is cheaper than searching
+			# the heap. Unless cancelled timers make up more than half of it, then they are all
+			# dropped at once, so that timers which are cancelled long before they are due don't
+			# keep piling up.
+			if self._cancelled > 16 and self._cancelled * 2 > len(self._heap):
+				self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+				heapq.heapify(self._heap)
+				self._cancelled = 0
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while True:
+					if self._stopped:
+						return
+					now = monotonic()
+					if self._heap and self._heap[0][0] <= now + self.slack:
+						break
+					self._condition.wait(self._heap[0][0] - now if self._heap else None)
+
+				due, _, timer = heapq.heappop(self._heap)
+				timer.queued = False
+				if timer.cancelled:
+					self._cancelled -= 1
+					continue
+				timer.running = True
+
+				lateness = max(0.0, now - due)
+				self._fired += 1
+				self._totallateness += lateness
+				if lateness > self.slack:
+					self._late += 1
+				self._maxlateness = max(self._maxlateness, lateness)
+
+			try:
+				again = timer.callback(*timer.args)
+			except Exception:
+				logger.exception("Timer callback %s failed, stopping it", timer.callback)
+				again = False
+
+			with self._condition:
+				timer.running = False
+				if timer.repeat and again and not timer.cancelled and not self._stopped:
+					# Keep the rate, but don't make up for missed calls after a long stall
+					self._push(timer, max(timer._base + timer.interval, monotonic()))
+				else:
+					timer.cancelled = True
+					timer.done.set()
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+## Returns the scheduler shared by the whole process
+def default_scheduler():
+	global _default_scheduler
+	with _default_lock:
+		if _default_scheduler is None:
+			_default_scheduler = Scheduler()
+		return _default_scheduler
@@ -1,10 +1,12 @@
 import dbus
+from gi.repository import GLib
 import logging
 import time
 from functools import partial
 
 # Local imports
 from vedbus import VeDbusItemImport
+from ve_utils import wrap_dbus_value, unwrap_dbus_value
 
 ## Indexes for the setting dictonary.
 PATH = 0
@@ -35,7 +37,13 @@ class SettingsDevice(object):
 	# @param eventCallback function that will be called on changes on any of these settings
 	# @param timeout Maximum interval to wait for localsettings. An exception is thrown at the end of the
 	# interval if the localsettings D-Bus service has not appeared yet.
-	def __init__(self, bus, supportedSettings, eventCallback, name='com.victronenergy.settings', timeout=0):
+	# @param batched when True, wait for localsettings with the NameOwnerChanged signal instead of polling,
+	# get all values with one GetItems call and add, or adjust, all settings with one AddSettings call,
+	# instead of several calls per setting. This needs the GLib main loop integration of dbus
+	# (DBusGMainLoop). Falls back to adding the settings one by one when localsettings doesn't
+	# support these calls.
+	def __init__(self, bus, supportedSettings, eventCallback, name='com.victronenergy.settings', timeout=0,
+			batched=False):
 		logging.debug("===== Settings device init starting... =====")
 		self._bus = bus
 		self._dbus_name = name
@@ -43,6 +51,16 @@ class SettingsDevice(object):
 		self._values = {} # stored the values, used to pass the old value along on a setting change
 		self._settings = {}
 
+		if batched:
+			self._wait_for_settings(timeout)
+			try:
+				self._add_settings_batched(supportedSettings)
+			except dbus.exceptions.DBusException as e:
+				logging.warning("Adding the settings at once failed (%s), adding them one by one" % e)
+				self.addSettings(supportedSettings)
+			logging.debug("===== Settings device init finished =====")
+			return
+
 		count = 0
 		while True:
 			if 'com.victronenergy.settings' in self._bus.list_names():
@@ -58,6 +76,80 @@ class SettingsDevice(object):
 
 		logging.debug("===== Settings device init finished =====")
 
+	def _wait_for_settings(self, timeout):
+		if self._bus.name_has_owner(self._dbus_name):
+			return
+		if timeout == 0:
+			raise Exception("The settings service %s does not exist!" % self._dbus_name)
+
+		logging.info('waiting for settings')
+		appeared = []
+		expired = []
+		match = self._bus.add_signal_receiver(
+			lambda name, oldowner, newowner: newowner and appeared.append(newowner),
+			signal_name='NameOwnerChanged', dbus_interface='org.freedesktop.DBus', arg0=self._dbus_name)
+		timer = GLib.timeout_add_seconds(timeout, lambda: expired.append(True))
+		try:
+			# It might have appeared before the signal was subscribed to
+			if self._bus.name_has_owner(self._dbus_name):
+				return
+			context = GLib.MainContext.default()
+			while not appeared:
+				if expired:
+					raise Exception("The settings service %s does not exist!" % self._dbus_name)
+				context.iteration(True)
+		finally:
+			match.remove()
+			if not expired:
+				GLib.source_remove(timer)
+
+	def _add_settings_batched(self, settings):
+		root = self._bus.get_object(self._dbus_name, '/', introspect=False)
+
+		# Existing settings are left alone by localsettings, unless their default, min, max or
+		# silent flag changed. So all settings are passed, as addSetting also adjusts them.
+		request = []
+		for setting, options in settings.items():
+			s = {
+				'path': options[PATH],
+				'default': wrap_dbus_value(options[VALUE]),
+				'min': wrap_dbus_value(options[MINIMUM]),
+				'max': wrap_dbus_value(options[MAXIMUM]),
+			}
+			if len(options) > SILENT and options[SILENT]:
+				s['silent'] = dbus.Boolean(True, variant_level=1)
+			request.append(s)
+
+		failed = set()
+		if request:
+			results = root.AddSettings(request, signature='aa{sv}',
+				dbus_interface='com.victronenergy.Settings')
+			for r in results:
+				if r.get('error', 0) != 0:
+					logging.warning("Setting %s could not be added, error %s" % (r.get('path'), r['error']))
+					failed.add(str(r.get('path')))
+
+		# Read the values after adding the settings, as localsettings may have adjusted them to a
+		# changed min or max.
+		items = root.GetItems(dbus_interface='com.victronenergy.BusItem')
+
+		# Create the items without a GetValue each, and seed them from the values fetched above.
+		# Settings that could not be added are invalid. Paths missing from the reply are left to
+		# the importer to fetch.
+		for setting, options in settings.items():
+			path = options[PATH]
+			busitem = VeDbusItemImport(self._bus, self._dbus_name, path,
+				partial(self.handleChangedSetting, setting), blocking=False)
+			self._settings[setting] = busitem
+			if path in failed:
+				busitem.seed_value(None)
+			else:
+				try:
+					busitem.seed_value(unwrap_dbus_value(items[path]['Value']))
+				except (KeyError, TypeError):
+					pass
+			self._values[setting] = busitem.get_value()
+
 	def addSettings(self, settings):
 		for setting, options in settings.items():
 			silent = len(options) > SILENT and options[SILENT]
@@ -6,10 +6,105 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import asyncio
 import codecs
+import os
+import re
+import select
+from signal import SIGTERM, SIGKILL
 import threading
 import subprocess
-from time import sleep
+from time import sleep, monotonic
+
+# Max length on pubnub is 1800 chars
+MAXMESSAGELENGTH = 1800
+
+_utf8_decoder = codecs.getdecoder("utf_8")
+_latin1_decoder = codecs.getdecoder("latin1")
+
+def decode(line):
+	try:
+		unicode_line, _ = _utf8_decoder(line)
+	except UnicodeDecodeError:
+		unicode_line, _ = _latin1_decoder(line)
+	return unicode_line
+
+_linebreak = re.compile(rb'[\r\n]')
+
+# Returns where to cut data, so that an incomplete UTF-8 sequence at its end is left for later
+def _utf8_cut(data):
+	end = len(data)
+	for i in range(end - 1, max(end - 4, 0) - 1, -1):
+		b = data[i]
+		if b & 0xC0 != 0x80:
+			# Lead byte, cut before it when its sequence is not complete
+			needed = 4 if b >= 0xF0 else 3 if b >= 0xE0 else 2 if b >= 0xC0 else 1
+			return i if end - i < needed else end
+	return end
+
+# Splits the output of a command in lines, and sends them in batches as "running" feedback.
+# Both \n and \r end a line, so that progress bars are passed on as they are drawn. A batch is
+# sent when the next line would make it longer than maxmessagelength, or when the deadline,
+# maxdelay seconds after its first line, has passed. Lines longer than maxmessagelength are split
+# over several messages, also while they are still incomplete, so that no more than
+# maxmessagelength bytes of output are kept.
+class OutputBatcher(object):
+	def __init__(self, feedbacksender, maxmessagelength=MAXMESSAGELENGTH, maxdelay=0.5):
+		self.feedbacksender = feedbacksender
+		self.maxmessagelength = maxmessagelength
+		self.maxdelay = maxdelay
+		self.deadline = None
+		self._partial = bytearray()
+		self._batch = []
+		self._batchlength = 0
+
+	def feed(self, chunk):
+		partial = self._partial
+		start = len(partial)
+		partial += chunk
+
+		end = 0
+		for m in _linebreak.finditer(partial, start):
+			self._add(decode(partial[end:m.end()]))
+			end = m.end()
+
+		if len(partial) - end >= self.maxmessagelength:
+			cut = _utf8_cut(partial)
+			if cut <= end:
+				cut = len(partial)
+			self._add(decode(partial[end:cut]))
+			end = cut
+		del partial[:end]
+
+	# Sends the batch when its deadline has passed
+	def poll(self):
+		if self.deadline is not None and monotonic() >= self.deadline:
+			self.flush()
+
+	# Sends what is left, at the end of the output
+	def finish(self):
+		if self._partial:
+			self._add(decode(self._partial))
+			self._partial = bytearray()
+		self.flush()
+
+	def flush(self):
+		if self._batch:
+			self.feedbacksender.send({"status": "running", "xmloutput": "".join(self._batch)})
+		self._batch = []
+		self._batchlength = 0
+		self.deadline = None
+
+	def _add(self, text):
+		while text:
+			if self._batchlength + len(text) > self.maxmessagelength:
+				self.flush()
+			part = text[:self.maxmessagelength]
+			text = text[self.maxmessagelength:]
+			self._batch.append(part)
+			self._batchlength += len(part)
+			if self.deadline is None:
+				self.deadline = monotonic() + self.maxdelay
 
 # Runs a command, and calls sendfeedback with the statusupdates.
 class StreamCommand(object):
@@ -18,18 +113,28 @@ class StreamCommand(object):
 		9: "SIGKILL", 10: "SIGBUS", 11: "SIGSEGV", 12: "SIGSYS", 13: "SIGPIPE", 14: "SIGALRM",
 		15: "SIGTERM"}
 
-	def run(self, command, timeout, feedbacksender):
+	## Runs the command, and returns its exitcode.
+	# @param streaming			when False, the output is sent per line, every 40 ms. When True, stdout and
+	#							stderr are relayed as fast as they are written, combined in messages of at
+	#							most maxmessagelength characters, sent at least every maxdelay seconds.
+	# @param maxmessagelength	see streaming.
+	# @param maxdelay			see streaming.
+	def run(self, command, timeout, feedbacksender, streaming=False, maxmessagelength=MAXMESSAGELENGTH,
+			maxdelay=0.5):
 		self.feedbacksender = feedbacksender
 		self.returncode = None
 		self.utf8_decoder = codecs.getdecoder("utf_8")
 		self.latin1_decoder = codecs.getdecoder("latin1")
+		self.maxmessagelength = maxmessagelength
+		self.maxdelay = maxdelay
 
 		def target():
 			logger.info('Thread started for running %s' % command)
 			self.feedbacksender.send({"status": "starting"})
 
 			try:
-				self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+				self.process = subprocess.Popen(command, stdout=subprocess.PIPE,
+					stderr=subprocess.STDOUT if streaming else subprocess.DEVNULL)
 			except OSError as e:
 				logger.info("Command %s could not be started, errno: %s, msg: %s"
 					% (command, e.errno, e.strerror))
@@ -40,7 +145,10 @@ class StreamCommand(object):
 				self.process = None
 				return
 
-			self.readandsend()
+			if streaming:
+				self.streamandsend()
+			else:
+				self.readandsend()
 
 
 		thread = threading.Thread(target=target)
@@ -51,8 +159,10 @@ class StreamCommand(object):
 			# Error message has already beent sent
 			return None
 
-		# Make sure to send all the output
-		self.readandsend()
+		# Make sure to send all the output. When streaming, the thread does that itself, until the
+		# output is closed.
+		if not streaming:
+			self.readandsend()
 
 		if thread.is_alive():
 			logger.warning("Command %s will now be terminated because of timeout" % command)
@@ -91,3 +201,126 @@ class StreamCommand(object):
 			if line == b'' and self.process.poll() != None:
 				break
 			sleep(0.04)
+
+	# Reads the output in large chunks as soon as it is available, and sends it in batches of whole lines.
+	def streamandsend(self):
+		fd = self.process.stdout.fileno()
+		batcher = OutputBatcher(self.feedbacksender, self.maxmessagelength, self.maxdelay)
+
+		while True:
+			timeout = None if batcher.deadline is None else max(0, batcher.deadline - monotonic())
+			readable, _, _ = select.select([fd], [], [], timeout)
+			if readable:
+				chunk = os.read(fd, 65536)
+				if chunk == b'':
+					# End of output
+					batcher.finish()
+					self.process.wait()
+					return
+				batcher.feed(chunk)
+			batcher.poll()
+
+
+## Runs commands with asyncio, so that many of them can run at the same time from one thread. Sends
+# the same feedback as StreamCommand, with its output streamed like StreamCommand does with
+# streaming=True.
+class AsyncStreamCommand(object):
+	## Constructor
+	# @param maxbuffer			the maximum number of bytes of output read, and kept, at once.
+	# @param maxmessagelength	the maximum length of the output in one feedback message.
+	# @param maxdelay			the maximum time output is held back to combine it with more output.
+	# @param killtimeout		seconds to wait after SIGTERM, before a command that timed out is killed.
+	def __init__(self, maxbuffer=65536, maxmessagelength=MAXMESSAGELENGTH, maxdelay=0.5, killtimeout=5):
+		self.maxbuffer = maxbuffer
+		self.maxmessagelength = maxmessagelength
+		self.maxdelay = maxdelay
+		self.killtimeout = killtimeout
+
+	## Runs the command, and returns its exitcode, or None if it could not be started.
+	async def run(self, command, timeout, feedbacksender):
+		logger.info('Running %s' % command)
+		feedbacksender.send({"status": "starting"})
+
+		try:
+			process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+				stderr=asyncio.subprocess.STDOUT, limit=self.maxbuffer, start_new_session=True)
+		except OSError as e:
+			logger.info("Command %s could not be started, errno: %s, msg: %s"
+				% (command, e.errno, e.strerror))
+			feedbacksender.send({"status": "error",
+				"errormessage": "Could not start (errno %s, msg %s)" % (e.errno, e.strerror),
+				"errorcode": 731}, finished=True)
+			return None
+
+		batcher = OutputBatcher(feedbacksender, self.maxmessagelength, self.maxdelay)
+		relay = asyncio.ensure_future(self._relay(process.stdout, batcher))
+
+		timedout = False
+		try:
+			await asyncio.wait_for(process.wait(), timeout)
+		except asyncio.TimeoutError:
+			timedout = True
+			logger.warning("Command %s will now be terminated because of timeout" % command)
+			await self._stop(process)
+			logger.warning("Command %s has been terminated" % command)
+
+		# Relay the rest of the output. Don't wait forever, a child of the command could
+		# keep the output open.
+		try:
+			await asyncio.wait_for(relay, self.killtimeout)
+		except asyncio.TimeoutError:
+			batcher.finish()
+
+		if timedout:
+			r = {"status": "error", "errormessage": "Stopped by timeout", "errorcode": 732}
+
+		elif process.returncode < 0:
+			signal = -1 * process.returncode
+			error = "Stopped with signal %d - %s" % (signal, StreamCommand.SIGNALS.get(signal, "unknown"))
+			logger.warning("Command %s abnormal stop. %s" % (command, error))
+			r = {"status": "error", "errorcode": 733, "errormessage": error}
+
+		else:
+			logger.info("Command %s execution completed. Exitcode %d" % (command, process.returncode))
+			r = {"status": "finished", "exitcode": process.returncode}
+
+		feedbacksender.send(r, finished=True)
+		return process.returncode
+
+	## Runs several commands at the same time, and returns their exitcodes in the same order.
+	# @param commands	iterable with a (command, timeout, feedbacksender) tuple per command.
+	async def run_many(self, commands):
+		return await asyncio.gather(*(self.run(*c) for c in commands))
+
+	# The command runs in a process group of its own, signal all of it, so that no children
+	# are left behind that keep the output open.
+	async def _stop(self, process):
+		try:
+			os.killpg(process.pid, SIGTERM)
+			await asyncio.wait_for(process.wait(), self.killtimeout)
+		except ProcessLookupError:
+			pass
+		except asyncio.TimeoutError:
+			logger.warning("Process %d did not stop, killing it" % process.pid)
+			try:
+				os.killpg(process.pid, SIGKILL)
+			except ProcessLookupError:
+				pass
+			await process.wait()
+
+	async def _relay(self, stream, batcher):
+		while True:
+			timeout = None if batcher.deadline is None else max(0, batcher.deadline - monotonic())
+			read = asyncio.ensure_future(stream.read(self.maxbuffer))
+			done, _ = await asyncio.wait((read,), timeout=timeout)
+			if not done:
+				batcher.flush()
+				chunk = await read
+			else:
+				chunk = read.result()
+
+			if chunk == b'':
+				batcher.finish()
+				return
+			batcher.feed(chunk)
+			batcher.poll()
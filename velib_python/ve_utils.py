@@ -201,7 +201,47 @@ def read_file(path):
 	return content
 
 
+def _wrap_int(value):
+	try:
+		return dbus.Int32(value, variant_level=1)
+	except OverflowError:
+		return dbus.Int64(value, variant_level=1)
+
+def _wrap_list(value):
+	if len(value) == 0:
+		# If the list is empty we cannot infer the type of the contents. So assume unsigned integer.
+		# A (signed) integer is dangerous, because an empty list of signed integers is used to encode
+		# an invalid value.
+		return dbus.Array([], signature=dbus.Signature('u'), variant_level=1)
+	return dbus.Array([wrap_dbus_value(x) for x in value], variant_level=1)
+
+def _wrap_dict(value):
+	# Wrapping the keys of the dictionary causes D-Bus errors like:
+	# 'arguments to dbus_message_iter_open_container() were incorrect,
+	# assertion "(type == DBUS_TYPE_ARRAY && contained_signature &&
+	# *contained_signature == DBUS_DICT_ENTRY_BEGIN_CHAR) || (contained_signature == NULL ||
+	# _dbus_check_is_valid_signature (contained_signature))" failed in file ...'
+	return dbus.Dictionary({k: wrap_dbus_value(v) for k, v in value.items()}, variant_level=1)
+
+# Looked up by the exact type of the value, subclasses go through the isinstance checks
+# in _wrap_dbus_value.
+_wrap_by_type = {
+	type(None): lambda value: VEDBUS_INVALID,
+	float: lambda value: dbus.Double(value, variant_level=1),
+	bool: lambda value: dbus.Boolean(value, variant_level=1),
+	int: _wrap_int,
+	str: lambda value: dbus.String(value, variant_level=1),
+	list: _wrap_list,
+	dict: _wrap_dict,
+}
+
 def wrap_dbus_value(value):
+	f = _wrap_by_type.get(type(value))
+	if f is None:
+		return _wrap_dbus_value(value)
+	return f(value)
+
+def _wrap_dbus_value(value):
 	if value is None:
 		return VEDBUS_INVALID
 	if isinstance(value, float):
@@ -209,42 +249,66 @@ def wrap_dbus_value(value):
 	if isinstance(value, bool):
 		return dbus.Boolean(value, variant_level=1)
 	if isinstance(value, int):
-		try:
-			return dbus.Int32(value, variant_level=1)
-		except OverflowError:
-			return dbus.Int64(value, variant_level=1)
+		return _wrap_int(value)
 	if isinstance(value, str):
 		return dbus.String(value, variant_level=1)
 	if isinstance(value, list):
-		if len(value) == 0:
-			# If the list is empty we cannot infer the type of the contents. So assume unsigned integer.
-			# A (signed) integer is dangerous, because an empty list of signed integers is used to encode
-			# an invalid value.
-			return dbus.Array([], signature=dbus.Signature('u'), variant_level=1)
-		return dbus.Array([wrap_dbus_value(x) for x in value], variant_level=1)
+		return _wrap_list(value)
 	if isinstance(value, dict):
-		# Wrapping the keys of the dictionary causes D-Bus errors like:
-		# 'arguments to dbus_message_iter_open_container() were incorrect,
-		# assertion "(type == DBUS_TYPE_ARRAY && contained_signature &&
-		# *contained_signature == DBUS_DICT_ENTRY_BEGIN_CHAR) || (contained_signature == NULL ||
-		# _dbus_check_is_valid_signature (contained_signature))" failed in file ...'
-		return dbus.Dictionary({(k, wrap_dbus_value(v)) for k, v in value.items()}, variant_level=1)
+		return _wrap_dict(value)
 	return value
 
 
 dbus_int_types = (dbus.Int32, dbus.UInt32, dbus.Byte, dbus.Int16, dbus.UInt16, dbus.UInt32, dbus.Int64, dbus.UInt64)
 
+def _unwrap_array(val):
+	v = [unwrap_dbus_value(x) for x in val]
+	return None if len(v) == 0 else v
+
+def _unwrap_list(val):
+	return [unwrap_dbus_value(x) for x in val]
+
+def _unwrap_dict(val):
+	# Do not unwrap the keys, see comment in wrap_dbus_value
+	return {x: unwrap_dbus_value(y) for x, y in val.items()}
+
+# Plain python values are returned as is
+_unwrapped_types = frozenset((type(None), bool, int, float, str))
+
+# Looked up by the exact type of the value, anything else goes through the isinstance
+# checks in _unwrap_dbus_value.
+_unwrap_by_type = dict.fromkeys(dbus_int_types, int)
+_unwrap_by_type.update({
+	dbus.Double: float,
+	dbus.Array: _unwrap_array,
+	dbus.Signature: str,
+	dbus.String: str,
+	dbus.Struct: _unwrap_list,
+	list: _unwrap_list,
+	tuple: _unwrap_list,
+	dbus.Dictionary: _unwrap_dict,
+	dict: _unwrap_dict,
+	dbus.Boolean: bool,
+})
 
 def unwrap_dbus_value(val):
 	"""Converts D-Bus values back to the original type. For example if val is of type DBus.Double,
 	a float will be returned."""
+	t = type(val)
+	if t in _unwrapped_types:
+		return val
+	f = _unwrap_by_type.get(t)
+	if f is None:
+		return _unwrap_dbus_value(val)
+	return f(val)
+
+def _unwrap_dbus_value(val):
 	if isinstance(val, dbus_int_types):
 		return int(val)
 	if isinstance(val, dbus.Double):
 		return float(val)
 	if isinstance(val, dbus.Array):
-		v = [unwrap_dbus_value(x) for x in val]
-		return None if len(v) == 0 else v
+		return _unwrap_array(val)
 	if isinstance(val, (dbus.Signature, dbus.String)):
 		return str(val)
 	# Python has no byte type, so we convert to an integer.
@@ -253,10 +317,9 @@ def unwrap_dbus_value(val):
 	if isinstance(val, dbus.ByteArray):
 		return "".join([bytes(x) for x in val])
 	if isinstance(val, (list, tuple)):
-		return [unwrap_dbus_value(x) for x in val]
+		return _unwrap_list(val)
 	if isinstance(val, (dbus.Dictionary, dict)):
-		# Do not unwrap the keys, see comment in wrap_dbus_value
-		return dict([(x, unwrap_dbus_value(y)) for x, y in val.items()])
+		return _unwrap_dict(val)
 	if isinstance(val, dbus.Boolean):
 		return bool(val)
 	return val
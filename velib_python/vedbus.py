@@ -2,12 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import dbus.service
+import dbus.lowlevel
+from gi.repository import GLib
 import logging
 import traceback
 import os
 import weakref
+from time import monotonic
+from bisect import bisect_left, insort
 from collections import defaultdict
-from ve_utils import wrap_dbus_value, unwrap_dbus_value
+from collections.abc import Mapping
+from ve_utils import exit_on_error, wrap_dbus_value, unwrap_dbus_value
 
 # vedbus contains three classes:
 # VeDbusItemImport -> use this to read data from the dbus, ie import
@@ -57,13 +62,35 @@ from ve_utils import wrap_dbus_value, unwrap_dbus_value
 #   The signature of a variant is 'v'.
 
 # Export ourselves as a D-Bus service.
+#
+# Changes made with service[path] = value are signalled right away, with a PropertiesChanged
+# signal per change. Set publishinterval (in ms) on the service, or per path in add_path, to
+# collect the changes instead and send them as one ItemsChanged signal at most once per interval.
+# Only the latest value of a path is sent.
+#
+# With virtual=True, the paths are not exported as dbus objects of their own. Instead a single
+# VeDbusFallbackExport on / serves all of them from a table of VeDbusVirtualItem objects. That
+# saves a lot of memory and registration time for services with many paths, and behaves the same
+# towards other processes, except that introspection does not list the child nodes.
 class VeDbusService(object):
-	def __init__(self, servicename, bus=None, register=True):
+	def __init__(self, servicename, bus=None, register=True, publishinterval=None, virtual=False):
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
 		self._dbusnodes = {}
+		# Sorted list of the paths in _dbusobjects, so that all paths below a node
+		# can be found without looking at all the others.
+		self._paths = []
+		# Number of paths in _dbusobjects below each node path, so that a node
+		# can be removed as soon as its last path is deleted.
+		self._nodecounts = {}
 		self._ratelimiters = []
+		# Publish interval per path, for paths that differ from the service
+		self._publishinterval = publishinterval
+		self._publishintervals = {}
+		# TimedPublisher objects, indexed by interval
+		self._publishers = {}
 		self._dbusname = None
+		self._virtual = virtual
 		self.name = servicename
 
 		# dict containing the onchange callbacks, for each object. Object path is the key
@@ -76,7 +103,10 @@ class VeDbusService(object):
 		self.dbusconn = self._dbusconn
 
 		# Add the root item that will return all items as a tree
-		self._dbusnodes['/'] = VeDbusRootExport(self._dbusconn, '/', self)
+		if virtual:
+			self._dbusnodes['/'] = VeDbusFallbackExport(self._dbusconn, '/', self)
+		else:
+			self._dbusnodes['/'] = VeDbusRootExport(self._dbusconn, '/', self)
 
 		# Immediately register the service unless requested not to
 		if register:
@@ -110,25 +140,118 @@ class VeDbusService(object):
 	# @param callbackonchange	function that will be called when this value is changed. First parameter will
 	#							be the path of the object, second the new value. This callback should return
 	#							True to accept the change, False to reject it.
+	# @param publishinterval	overrides the publishinterval of the service for this path, 0 to signal
+	#							changes right away.
+	# @param deadband			changes of a numeric value that are not larger than this are not signalled.
+	# @param relativedeadband	same as deadband, but as a fraction of the last signalled value. The larger
+	#							of both is used.
+	# @param mininterval		minimum time in ms between two signals for this path.
+	# @param maxage				time in ms after which a change that was held back is signalled anyway.
+	#							GetValue always returns the exact value. See PublishFilter.
 	def add_path(self, path, value, description="", writeable=False,
-					onchangecallback=None, gettextcallback=None, valuetype=None, itemtype=None):
-
-		if onchangecallback is not None:
-			self._onchangecallbacks[path] = onchangecallback
+					onchangecallback=None, gettextcallback=None, valuetype=None, itemtype=None,
+					publishinterval=None, deadband=None, relativedeadband=None, mininterval=None,
+					maxage=None):
 
-		itemtype = itemtype or VeDbusItemExport
-		item = itemtype(self._dbusconn, path, value, description, writeable,
-				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype)
+		item = self._create_item(path, value, description, writeable, onchangecallback,
+			gettextcallback, valuetype, itemtype, publishinterval, deadband, relativedeadband,
+			mininterval, maxage)
 
 		spl = path.split('/')
-		for i in range(2, len(spl)):
-			subPath = '/'.join(spl[:i])
-			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
-				self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+		if not self._virtual:
+			for i in range(2, len(spl)):
+				subPath = '/'.join(spl[:i])
+				if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
+					self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+		if path not in self._dbusobjects:
+			insort(self._paths, path)
+			for i in range(2, len(spl)):
+				subPath = '/'.join(spl[:i])
+				self._nodecounts[subPath] = self._nodecounts.get(subPath, 0) + 1
 		self._dbusobjects[path] = item
-		logging.debug('added %s with start value %s. Writeable is %s' % (path, value, writeable))
+		logging.debug('added %s with start value %s. Writeable is %s', path, value, writeable)
 		return item
 
+	## Adds many paths at once, which is a lot quicker than calling add_path for each of them.
+	# @param paths	iterable of tuples with the positional arguments of add_path, or of dicts with
+	#				its keyword arguments.
+	# @return list with the created items, in the same order.
+	def add_paths(self, paths):
+		paths = list(paths)
+		if self._virtual:
+			# Checked before any item is created, see _create_item
+			added = set()
+			for args in paths:
+				path = args['path'] if isinstance(args, dict) else args[0]
+				if path in added:
+					self._path_exists(path)
+				added.add(path)
+				if path in self._dbusobjects:
+					self._path_exists(path)
+
+		items = []
+		for args in paths:
+			if isinstance(args, dict):
+				item = self._create_item(**args)
+			else:
+				item = self._create_item(*args)
+			items.append(item)
+
+		# Insert the items, and count them per node in the same go
+		nodecounts = self._nodecounts
+		added = []
+		for item in items:
+			path = item.__dbus_object_path__
+			if path not in self._dbusobjects:
+				added.append(path)
+				spl = path.split('/')
+				for i in range(2, len(spl)):
+					subPath = '/'.join(spl[:i])
+					nodecounts[subPath] = nodecounts.get(subPath, 0) + 1
+			self._dbusobjects[path] = item
+
+		# Now that all items are known, create the nodes that are not an item
+		if not self._virtual:
+			for subPath in nodecounts:
+				if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
+					self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+
+		self._paths.extend(added)
+		self._paths.sort()
+		logging.debug('added %d paths', len(items))
+		return items
+
+	def _create_item(self, path, value, description="", writeable=False,
+					onchangecallback=None, gettextcallback=None, valuetype=None, itemtype=None,
+					publishinterval=None, deadband=None, relativedeadband=None, mininterval=None,
+					maxage=None):
+		# A dbus object can't be registered twice on the same path. Virtual items aren't registered,
+		# so check that here. Replacing the item would also have the old one delete the path
+		# from the service when it is garbage collected.
+		if self._virtual and path in self._dbusobjects:
+			self._path_exists(path)
+		if onchangecallback is not None:
+			self._onchangecallbacks[path] = onchangecallback
+		if publishinterval is not None:
+			self._publishintervals[path] = publishinterval
+
+		kwargs = {}
+		if deadband or relativedeadband or mininterval:
+			publishfilter = PublishFilter(deadband, relativedeadband, mininterval, maxage)
+			if publishinterval if publishinterval is not None else self._publishinterval:
+				publishfilter.publisher = self._publish_later
+			kwargs['publishfilter'] = publishfilter
+
+		itemtype = itemtype or (VeDbusVirtualItem if self._virtual else VeDbusItemExport)
+		return itemtype(self._dbusconn, path, value, description, writeable,
+				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype,
+				**kwargs)
+
+	@staticmethod
+	def _path_exists(path):
+		# Same error as dbus-python raises for a non-virtual item
+		raise KeyError("Can't register the object-path handler for '%s': there is already a handler" % path)
+
 	# Add the mandatory paths, as per victron dbus api doc
 	def add_mandatory_paths(self, processname, processversion, connection,
 			deviceinstance, productid, productname, firmwareversion, hardwareversion, connected):
@@ -152,22 +275,94 @@ class VeDbusService(object):
 
 		return self._onchangecallbacks[path](path, newvalue)
 
+	# Implements SetItems, see VeDbusRootExport. All values are checked, and passed to the
+	# onchangecallbacks, before any of them is set. So either all values are set, or none is.
+	# When a callback rejects its value, the callbacks that accepted theirs are called again
+	# with the current value, so that they can undo what they did for the new one.
+	def _set_items(self, items):
+		accepted = []
+		for path, newvalue in items.items():
+			item = self._dbusobjects.get(path, None)
+			if item is None:
+				raise dbus.exceptions.DBusException("No such object path %s" % path,
+					name='org.freedesktop.DBus.Error.UnknownObject')
+			r, newvalue = item._check_value(newvalue)
+			if r != 0:
+				return r
+			if newvalue != item._value:
+				accepted.append((item, path, newvalue))
+
+		for n, (item, path, newvalue) in enumerate(accepted):
+			if item._onchangecallback is not None and not item._onchangecallback(path, newvalue):
+				for item, path, newvalue in reversed(accepted[:n]):
+					if item._onchangecallback is not None:
+						item._onchangecallback(path, item._value)
+				return 2  # NOT OK
+
+		# Set them all, and signal the changes in one ItemsChanged
+		with self as ctx:
+			for item, path, newvalue in accepted:
+				ctx[path] = newvalue
+		return 0  # OK
+
 	def _item_deleted(self, path):
 		self._dbusobjects.pop(path)
-		for np in list(self._dbusnodes.keys()):
-			if np != '/':
-				for ip in self._dbusobjects:
-					if ip.startswith(np + '/'):
-						break
-				else:
-					self._dbusnodes[np].__del__()
-					self._dbusnodes.pop(np)
+		self._publishintervals.pop(path, None)
+		for publisher in self._publishers.values():
+			publisher.discard(path)
+		del self._paths[bisect_left(self._paths, path)]
+
+		# Only the ancestors of this path can have become empty
+		spl = path.split('/')
+		for i in range(2, len(spl)):
+			np = '/'.join(spl[:i])
+			count = self._nodecounts[np] - 1
+			if count > 0:
+				self._nodecounts[np] = count
+				continue
+			del self._nodecounts[np]
+			node = self._dbusnodes.pop(np, None)
+			if node is not None:
+				node.__del__()
+
+	# Returns the paths below the given node path, which must end with a '/'.
+	def _get_subtree(self, prefix):
+		# Paths that start with the prefix are sorted right after it, and
+		# before the prefix with its trailing / replaced by the next character.
+		paths = self._paths
+		return paths[bisect_left(paths, prefix):bisect_left(paths, prefix[:-1] + '0')]
+
+	# Returns the values, or texts, of all paths below path, relative to it.
+	def _get_tree_values(self, path, get_text=False):
+		r = {}
+		px = path
+		if not px.endswith('/'):
+			px += '/'
+		items = self._dbusobjects
+		for p in self._get_subtree(px):
+			item = items[p]
+			v = item.GetText() if get_text else item.GetValue()
+			r[p[len(px):]] = v
+		return r
 
 	def __getitem__(self, path):
 		return self._dbusobjects[path].local_get_value()
 
 	def __setitem__(self, path, newvalue):
-		self._dbusobjects[path].local_set_value(newvalue)
+		interval = self._publishintervals.get(path, self._publishinterval)
+		if not interval:
+			self._dbusobjects[path].local_set_value(newvalue)
+		elif self._dbusobjects[path]._local_set_value(newvalue) is not None:
+			self._publish_later(path)
+
+	# Leaves signalling the change of the path to the TimedPublisher of its publish interval
+	def _publish_later(self, path):
+		interval = self._publishintervals.get(path, self._publishinterval)
+		try:
+			publisher = self._publishers[interval]
+		except KeyError:
+			publisher = self._publishers[interval] = TimedPublisher(self, interval)
+		publisher.add(path)
 
 	def __delitem__(self, path):
 		self._dbusobjects[path].__del__()  # Invalidates and then removes the object path
@@ -215,21 +410,52 @@ class ServiceContext(object):
 
 	def add_path(self, path, value, *args, **kwargs):
 		self.parent.add_path(path, value, *args, **kwargs)
-		self.changes[path] = {
-			'Value': wrap_dbus_value(value),
-			'Text': self.parent._dbusobjects[path].GetText()
-		}
+		self.changes[path] = self.parent._dbusobjects[path]._get_changes()
 
 	def del_tree(self, root):
 		root = root.rstrip('/')
-		for p in list(self.parent._dbusobjects.keys()):
-			if p == root or p.startswith(root + '/'):
-				self[p] = None
-				self.parent._dbusobjects[p].__del__()
+		paths = self.parent._get_subtree(root + '/')
+		if root in self.parent._dbusobjects:
+			paths.append(root)
+		for p in paths:
+			self[p] = None
+			self.parent._dbusobjects[p].__del__()
 
 	def get_name(self):
 		return self.parent.get_name()
 
+class TimedPublisher(object):
+	""" Collects the paths changed with service[path] = value, and signals them
+	    in one ItemsChanged every interval ms. The values are taken when the
+	    signal is sent, so it always carries the latest value of each path. """
+	def __init__(self, parent, interval):
+		self.parent = parent
+		self.interval = interval
+		self.paths = {}
+		self._timer = None
+
+	def add(self, path):
+		self.paths[path] = None
+		if self._timer is None:
+			self._timer = GLib.timeout_add(self.interval, exit_on_error, self._on_timer)
+
+	def discard(self, path):
+		self.paths.pop(path, None)
+
+	def _on_timer(self):
+		self._timer = None
+		self.flush()
+		return False
+
+	def flush(self):
+		if not self.paths:
+			return
+		items = self.parent._dbusobjects
+		changes = { p: items[p]._get_changes() for p in self.paths if p in items }
+		self.paths = {}
+		if changes:
+			self.parent._dbusnodes['/'].ItemsChanged(changes)
+
 class TrackerDict(defaultdict):
 	""" Same as defaultdict, but passes the key to default_factory. """
 	def __missing__(self, key):
@@ -237,40 +463,195 @@ class TrackerDict(defaultdict):
 		return x
 
 class VeDbusRootTracker(object):
-	""" This tracks the root of a dbus path and listens for PropertiesChanged
+	""" This tracks the root of a dbus path and listens for ItemsChanged
 	    signals. When a signal arrives, parse it and unpack the key/value changes
 	    into traditional events, then pass it to the original eventCallback
-	    method. """
-	def __init__(self, bus, serviceName):
+	    method. It also listens for the PropertiesChanged signals of all paths
+	    of the service, with a single match, and passes those on to the
+	    importers of the path. Non-blocking importers are seeded from a single
+	    GetItems call on the root, shared by all importers created in the same
+	    main loop iteration. When the service leaves the dbus, the tracker
+	    removes itself from roots and invalidates its importers. """
+	def __init__(self, bus, serviceName, roots=None):
 		self.importers = defaultdict(weakref.WeakSet)
 		self.serviceName = serviceName
-		self._match = bus.get_object(serviceName, '/', introspect=False).connect_to_signal(
-			"ItemsChanged", weak_functor(self._items_changed_handler))
+		self._bus = bus
+		self._roots = roots
+		self._match = self._propertiesmatch = self._ownermatch = None
+		self._seeding = None
+		# The matches are on the well-known name, not on the unique name of the service
+		# at this moment, so they don't have to be redone when the service restarts.
+		self._match = bus.add_signal_receiver(weak_functor(self._items_changed_handler),
+			dbus_interface='com.victronenergy.BusItem', signal_name='ItemsChanged',
+			bus_name=serviceName, path='/')
+		self._propertiesmatch = bus.add_signal_receiver(weak_functor(self._properties_changed_handler),
+			dbus_interface='com.victronenergy.BusItem', signal_name='PropertiesChanged',
+			bus_name=serviceName, path_keyword='path')
+		self._ownermatch = bus.add_signal_receiver(weak_functor(self._name_owner_changed_handler),
+			dbus_interface='org.freedesktop.DBus', signal_name='NameOwnerChanged',
+			bus_name='org.freedesktop.DBus', arg0=serviceName)
 
 	def __del__(self):
-		self._match.remove()
-		self._match = None
+		self.close()
+
+	## Removes the signal matches. Done by VeDbusItemImport when the last importer is
+	# closed or garbage collected, and when the service left the dbus.
+	def close(self):
+		if self._seeding is not None:
+			if self._seeding is not True:
+				GLib.source_remove(self._seeding)
+			self._seeding = None
+		for name in ('_match', '_propertiesmatch', '_ownermatch'):
+			match = getattr(self, name)
+			if match is not None:
+				match.remove()
+				setattr(self, name, None)
+		self.importers.clear()
 
 	def add(self, i):
 		self.importers[i.path].add(i)
 
+	## Removes an importer, returns True if that was the last one.
+	def remove(self, i):
+		importers = self.importers.get(i.path, None)
+		if importers is not None:
+			importers.discard(i)
+			if len(importers) == 0:
+				del self.importers[i.path]
+		return not any(len(x) for x in self.importers.values())
+
+	## Schedules a GetItems call to seed the values of non-blocking importers. Importers that
+	# are added while a call is pending or in flight are seeded by that same call.
+	def seed(self):
+		if self._seeding is None:
+			self._seeding = GLib.idle_add(exit_on_error, self._get_items)
+
+	def _get_items(self):
+		# Nothing to do when the importers were seeded in the meantime
+		if all(i.ready for importers in self.importers.values() for i in importers):
+			self._seeding = None
+			return False
+		self._seeding = True  # in flight
+		self._bus.call_async(self.serviceName, '/', 'com.victronenergy.BusItem', 'GetItems', '', [],
+			self._seed_reply, self._seed_error)
+		return False
+
+	def _seed_reply(self, items):
+		if self._seeding is None:
+			return  # closed in the meantime
+		self._seeding = None
+		self.seed_items(items)
+
+	## Seeds the importers that are not ready yet from the reply of a GetItems call on the
+	# root of the service, done by the caller. Importers of paths that are not in items get
+	# their value with an async GetValue.
+	def seed_items(self, items):
+		for path, importers in list(self.importers.items()):
+			pending = [i for i in importers if not i.ready]
+			if not pending:
+				continue
+			try:
+				v = items[path]['Value']
+			except (KeyError, TypeError):
+				# Not in the reply, ask the path itself
+				for i in pending:
+					i._get_value_async()
+				continue
+			v = unwrap_dbus_value(v)
+			for i in pending:
+				i.seed_value(v)
+
+	def _seed_error(self, e):
+		if self._seeding is None:
+			return
+		self._seeding = None
+		# Older services don't implement GetItems on the root, fall back to a GetValue per path
+		logging.debug("GetItems on %s failed (%s), falling back to GetValue", self.serviceName, e)
+		for importers in list(self.importers.values()):
+			for i in importers:
+				if not i.ready:
+					i._get_value_async()
+
+	def _name_owner_changed_handler(self, name, oldowner, newowner):
+		if name != self.serviceName:
+			return
+		if oldowner:
+			# Left the dbus, or was replaced: the importers have to be created again
+			importers = [i for s in self.importers.values() for i in s]
+			if self._roots is not None and self._roots.get(self.serviceName, None) is self:
+				del self._roots[self.serviceName]
+			self.close()
+			for i in importers:
+				i._invalidate()
+		elif newowner:
+			# Wasn't there when the importers were created, fetch the values it starts with
+			for importers in self.importers.values():
+				for i in importers:
+					i._ready = False
+			self.seed()
+
+	def _properties_changed_handler(self, changes, path):
+		importers = self.importers.get(path, None)
+		if not importers or 'Value' not in changes:
+			return
+
+		record = ItemChanges(unwrap_dbus_value(changes['Value']), changes.get('Text', None))
+		for i in importers:
+			i._value_changed(record)
+
 	def _items_changed_handler(self, items):
 		if not isinstance(items, dict):
 			return
 
+		# Only paths that are imported are unwrapped, once, and the result is shared by all
+		# importers of the path.
+		importers = self.importers
 		for path, changes in items.items():
+			imported = importers.get(path, None)
+			if not imported:
+				continue
+
 			try:
 				v = changes['Value']
 			except KeyError:
 				continue
 
-			try:
-				t = changes['Text']
-			except KeyError:
-				t = str(unwrap_dbus_value(v))
+			record = ItemChanges(unwrap_dbus_value(v), changes.get('Text', None))
+			for i in imported:
+				i._value_changed(record)
+
+class ItemChanges(Mapping):
+	""" A read-only mapping with the unwrapped 'Value' and the 'Text' of a changed
+	    item. One instance is shared by all importers of a path; each eventCallback
+	    gets its own plain dict made from it. When the service didn't send a text,
+	    it is made from the value on first use. """
+	__slots__ = ('_value', '_text')
+	_keys = ('Value', 'Text')
+
+	def __init__(self, value, text=None):
+		self._value = value
+		self._text = text
 
-			for i in self.importers.get(path, ()):
-				i._properties_changed_handler({'Value': v, 'Text': t})
+	def __getitem__(self, key):
+		if key == 'Value':
+			return self._value
+		if key == 'Text':
+			if self._text is None:
+				self._text = str(self._value)
+			return self._text
+		raise KeyError(key)
+
+	def __contains__(self, key):
+		return key in self._keys
+
+	def __iter__(self):
+		return iter(self._keys)
+
+	def __len__(self):
+		return 2
+
+	def __repr__(self):
+		return repr(dict(self))
 
 """
 Importing basics:
@@ -293,15 +674,20 @@ Note that when a service leaves that D-Bus without invalidating all its exported
 example because it is killed, VeDbusItemImport doesn't have a clue. So when using VeDbusItemImport,
 make sure to also subscribe to the NamerOwnerChanged signal on bus-level. Or just use dbusmonitor,
 because that takes care of all of that for you.
+
+Call close() on an importer that is no longer needed. Once the last importer of a service is closed,
+or garbage collected, the root tracker of that service and its signal matches are removed as well.
+They are also removed when the service leaves the D-Bus. Its importers are invalidated then: their
+value becomes None, and they don't receive changes anymore, so create new ones when it comes back.
 """
 class VeDbusItemImport(object):
-	def __new__(cls, bus, serviceName, path, eventCallback=None, createsignal=True):
+	def __new__(cls, bus, serviceName, path, eventCallback=None, createsignal=True, blocking=True):
 		instance = object.__new__(cls)
 
 		# If signal tracking should be done, also add to root tracker
 		if createsignal:
 			if "_roots" not in cls.__dict__:
-				cls._roots = TrackerDict(lambda k: VeDbusRootTracker(bus, k))
+				cls._roots = TrackerDict(lambda k: VeDbusRootTracker(bus, k, cls._roots))
 
 		return instance
 
@@ -313,41 +699,101 @@ class VeDbusItemImport(object):
 	# @param createSignal   only set this to False if you use this function to one time read a value. When
 	#						leaving it to True, make sure to also subscribe to the NameOwnerChanged signal
 	#						elsewhere. See also note some 15 lines up.
-	def __init__(self, bus, serviceName, path, eventCallback=None, createsignal=True):
+	# @param blocking		when True, the constructor fetches the initial value with a blocking GetValue.
+	#						When False, the value is fetched asynchronously: importers of the same service
+	#						are seeded with a single GetItems on its root (or with an async GetValue when
+	#						createsignal is False). get_value() returns None, and ready is False, until the
+	#						reply arrived. This needs a running, or regularly iterated, GLib main loop.
+	def __init__(self, bus, serviceName, path, eventCallback=None, createsignal=True, blocking=True):
 		# TODO: is it necessary to store _serviceName and _path? Isn't it
 		# stored in the bus_getobjectsomewhere?
 		self._serviceName = serviceName
 		self._path = path
-		self._match = None
+		self._tracker = None
+		self._proxy = None
+		self._ready = False
 		# TODO: _proxy is being used in settingsdevice.py, make a getter for that
-		self._proxy = bus.get_object(serviceName, path, introspect=False)
+		# Following the name owner changes saves the blocking GetNameOwner call, but needs the
+		# main loop, which only non-blocking importers can count on.
+		self._proxy = bus.get_object(serviceName, path, introspect=False,
+			follow_name_owner_changes=not blocking)
 		self.eventCallback = eventCallback
 
 		assert eventCallback is None or createsignal == True
 		if createsignal:
-			self._match = self._proxy.connect_to_signal(
-				"PropertiesChanged", weak_functor(self._properties_changed_handler))
-			self._roots[serviceName].add(self)
+			# Signals are received by the root tracker of the service
+			self._tracker = self._roots[serviceName]
+			self._tracker.add(self)
 
 		# store the current value in _cachedvalue. When it doesn't exists set _cachedvalue to
 		# None, same as when a value is invalid
 		self._cachedvalue = None
+		if not blocking:
+			if self._tracker is not None:
+				self._tracker.seed()
+			else:
+				self._get_value_async()
+			return
+
 		try:
 			v = self._proxy.GetValue()
 		except dbus.exceptions.DBusException:
 			pass
 		else:
 			self._cachedvalue = unwrap_dbus_value(v)
+		self._ready = True
 
 	def __del__(self):
-		if self._match is not None:
-			self._match.remove()
-			self._match = None
+		self.close()
+
+	## Stops tracking the value and releases the proxy. The importer can not be used anymore
+	# afterwards. Evicts the root tracker of the service when this was its last importer.
+	def close(self):
+		tracker = getattr(self, '_tracker', None)
+		if tracker is not None:
+			self._tracker = None
+			if tracker.remove(self):
+				if self._roots.get(self._serviceName, None) is tracker:
+					del self._roots[self._serviceName]
+				tracker.close()
 		self._proxy = None
 
+	## Called by the root tracker when the service left the dbus. The value becomes invalid,
+	# and no changes are received anymore.
+	def _invalidate(self):
+		self._tracker = None
+		if self._cachedvalue is not None:
+			self._value_changed(ItemChanges(None, '---'))
+		self._ready = True
+
 	def _refreshcachedvalue(self):
 		self._cachedvalue = unwrap_dbus_value(self._proxy.GetValue())
 
+	def _get_value_async(self):
+		if self._proxy is not None:
+			self._proxy.GetValue(reply_handler=self._get_value_reply,
+				error_handler=self._get_value_error)
+
+	def _get_value_reply(self, v):
+		self.seed_value(unwrap_dbus_value(v))
+
+	def _get_value_error(self, e):
+		# Same as the blocking constructor: a path that doesn't exist is invalid
+		self.seed_value(None)
+
+	## Sets the initial value of a non-blocking importer, for example by a caller that got it
+	# with a call of its own already. Ignored when the importer is ready, because a signal
+	# already brought in a newer value.
+	def seed_value(self, v):
+		if not self._ready:
+			self._cachedvalue = v
+			self._ready = True
+
+	## Returns False while the initial value of a non-blocking importer is still being fetched
+	@property
+	def ready(self):
+		return self._ready
+
 	## Returns the path as a string, for example '/AC/L1/V'
 	@property
 	def path(self):
@@ -412,27 +858,35 @@ class VeDbusItemImport(object):
 	def eventCallback(self, eventCallback):
 		self._eventCallback = eventCallback
 
-	## Is called when the value of the imported bus-item changes.
-	# Stores the new value in our local cache, and calls the eventCallback, if set.
+	## Is called when the value of the imported bus-item changes, with the raw changes of a
+	# PropertiesChanged signal.
 	def _properties_changed_handler(self, changes):
 		if "Value" in changes:
-			changes['Value'] = unwrap_dbus_value(changes['Value'])
-			self._cachedvalue = changes['Value']
-			if self._eventCallback:
-				# The reason behind this try/except is to prevent errors silently ending up the an error
-				# handler in the dbus code.
-				try:
-					self._eventCallback(self._serviceName, self._path, changes)
-				except:
-					traceback.print_exc()
-					os._exit(1)  # sys.exit() is not used, since that also throws an exception
+			self._value_changed(ItemChanges(unwrap_dbus_value(changes['Value']),
+				changes.get('Text', None)))
+
+	## Is called by the root tracker with the already unwrapped changes, which are shared with
+	# the other importers of the path and must not be modified.
+	# Stores the new value in our local cache, and calls the eventCallback, if set, with a
+	# dict of its own, which it is free to modify.
+	def _value_changed(self, changes):
+		self._cachedvalue = changes['Value']
+		self._ready = True
+		if self._eventCallback:
+			# The reason behind this try/except is to prevent errors silently ending up the an error
+			# handler in the dbus code.
+			try:
+				self._eventCallback(self._serviceName, self._path, dict(changes))
+			except:
+				traceback.print_exc()
+				os._exit(1)  # sys.exit() is not used, since that also throws an exception
 
 
 class VeDbusTreeExport(dbus.service.Object):
 	def __init__(self, bus, objectPath, service):
 		dbus.service.Object.__init__(self, bus, objectPath)
 		self._service = service
-		logging.debug("VeDbusTreeExport %s has been created" % objectPath)
+		logging.debug("VeDbusTreeExport %s has been created", objectPath)
 
 	def __del__(self):
 		# self._get_path() will raise an exception when retrieved after the call to .remove_from_connection,
@@ -449,15 +903,8 @@ class VeDbusTreeExport(dbus.service.Object):
 		return self._locations[0][1]
 
 	def _get_value_handler(self, path, get_text=False):
-		logging.debug("_get_value_handler called for %s" % path)
-		r = {}
-		px = path
-		if not px.endswith('/'):
-			px += '/'
-		for p, item in self._service._dbusobjects.items():
-			if p.startswith(px):
-				v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
-				r[p[len(px):]] = v
+		logging.debug("_get_value_handler called for %s", path)
+		r = self._service._get_tree_values(path, get_text)
 		logging.debug(r)
 		return r
 
@@ -480,31 +927,98 @@ class VeDbusRootExport(VeDbusTreeExport):
 
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}')
 	def GetItems(self):
-		return {
-			path: {
-				'Value': wrap_dbus_value(item.local_get_value()),
-				'Text': item.GetText() }
-			for path, item in self._service._dbusobjects.items()
-		}
+		return { path: item._get_changes() for path, item in self._service._dbusobjects.items() }
+
+	## Dbus exported method SetItems
+	# Sets the values of several paths at once, and signals them in one ItemsChanged.
+	# @param items dict with the new values by path.
+	# @return completion-code, the same as SetValue. When it is not 0, none of the values is set.
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='a{sv}', out_signature='i')
+	def SetItems(self, items):
+		return self._service._set_items(items)
+
+class VeDbusFallbackExport(dbus.service.FallbackObject):
+	""" Serves all paths of a VeDbusService created with virtual=True from one
+	    object on /. Calls on a path of an item are passed to its VeDbusVirtualItem,
+	    calls on any other path below / are answered like VeDbusTreeExport does. """
+	def __init__(self, bus, objectPath, service):
+		dbus.service.FallbackObject.__init__(self, bus, objectPath)
+		self._service = service
 
+	def __del__(self):
+		if len(self._locations) == 0:
+			return
+		self.remove_from_connection()
 
-class VeDbusItemExport(dbus.service.Object):
-	## Constructor of VeDbusItemExport
-	#
-	# Use this object to export (publish), values on the dbus
-	# Creates the dbus-object under the given dbus-service-name.
-	# @param bus		  The dbus object.
-	# @param objectPath	  The dbus-object-path.
-	# @param value		  Value to initialize ourselves with, defaults to None which means Invalid
-	# @param description  String containing a description. Can be called over the dbus with GetDescription()
-	# @param writeable	  what would this do!? :).
-	# @param callback	  Function that will be called when someone else changes the value of this VeBusItem
-	#                     over the dbus. First parameter passed to callback will be our path, second the new
-	#					  value. This callback should return True to accept the change, False to reject it.
-	def __init__(self, bus, objectPath, value=None, description=None, writeable=False,
-					onchangecallback=None, gettextcallback=None, deletecallback=None,
-					valuetype=None):
-		dbus.service.Object.__init__(self, bus, objectPath)
+	def _get_item(self, path):
+		return self._service._dbusobjects.get(path, None)
+
+	def _check_node(self, path):
+		if path != '/' and not self._service._get_subtree(path + '/'):
+			raise dbus.exceptions.DBusException("No such object path %s" % path,
+				name='org.freedesktop.DBus.Error.UnknownObject')
+
+	def _get_method_item(self, path):
+		item = self._get_item(path)
+		if item is None:
+			self._check_node(path)
+			raise dbus.exceptions.UnknownMethodException("Not supported on %s" % path)
+		return item
+
+	@dbus.service.signal('com.victronenergy.BusItem', signature='a{sa{sv}}')
+	def ItemsChanged(self, changes):
+		pass
+
+	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}', path_keyword='path')
+	def GetItems(self, path):
+		if path != '/':
+			self._check_node(path)
+			raise dbus.exceptions.UnknownMethodException("Not supported on %s" % path)
+		return { p: item._get_changes() for p, item in self._service._dbusobjects.items() }
+
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='a{sv}', out_signature='i', path_keyword='path')
+	def SetItems(self, items, path):
+		if path != '/':
+			self._check_node(path)
+			raise dbus.exceptions.UnknownMethodException("Not supported on %s" % path)
+		return self._service._set_items(items)
+
+	@dbus.service.method('com.victronenergy.BusItem', out_signature='v', path_keyword='path')
+	def GetValue(self, path):
+		item = self._get_item(path)
+		if item is not None:
+			return item.GetValue()
+		self._check_node(path)
+		value = self._service._get_tree_values(path)
+		return dbus.Dictionary(value, signature=dbus.Signature('sv'), variant_level=1)
+
+	# Items return a string, nodes a variant holding the texts by path, so the
+	# signature of the reply is derived from the returned value.
+	@dbus.service.method('com.victronenergy.BusItem', out_signature=None, path_keyword='path')
+	def GetText(self, path):
+		item = self._get_item(path)
+		if item is not None:
+			return dbus.String(item.GetText())
+		self._check_node(path)
+		text = self._service._get_tree_values(path, True)
+		return dbus.Dictionary(text, signature=dbus.Signature('ss'), variant_level=1)
+
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='v', out_signature='i', path_keyword='path')
+	def SetValue(self, newvalue, path):
+		return self._get_method_item(path).SetValue(newvalue)
+
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='si', out_signature='s', path_keyword='path')
+	def GetDescription(self, language, length, path):
+		return self._get_method_item(path).GetDescription(language, length)
+
+
+class VeDbusItemBase(object):
+	""" The handling of the value of an exported item, shared by VeDbusItemExport
+	    and VeDbusVirtualItem. """
+	__slots__ = ()
+
+	def _init_value(self, value, description, writeable, onchangecallback, gettextcallback,
+			deletecallback, valuetype, publishfilter):
 		self._onchangecallback = onchangecallback
 		self._gettextcallback = gettextcallback
 		self._value = value
@@ -513,22 +1027,18 @@ class VeDbusItemExport(dbus.service.Object):
 		self._deletecallback = deletecallback
 		self._type = valuetype
 
-	# To force immediate deregistering of this dbus object, explicitly call __del__().
-	def __del__(self):
-		# self._get_path() will raise an exception when retrieved after the
-		# call to .remove_from_connection, so we need a copy.
-		path = self._get_path()
-		if path == None:
-			return
-		if self._deletecallback is not None:
-			self._deletecallback(path)
-		self.remove_from_connection()
-		logging.debug("VeDbusItemExport %s has been removed" % path)
+		# The value wrapped for the dbus, its text, and both as a changes dict.
+		# Created when first needed and replaced when the value changes, so that
+		# GetValue, GetText and GetItems do not convert and call the
+		# gettextcallback over and over again. Note that a text that depends on
+		# anything else than the value is only updated on the next change.
+		self._wrapped = None
+		self._text = None
+		self._changes = None
 
-	def _get_path(self):
-		if len(self._locations) == 0:
-			return None
-		return self._locations[0][1]
+		self._filter = publishfilter
+		if publishfilter is not None:
+			publishfilter.published(value, monotonic())
 
 	## Sets the value. And in case the value is different from what it was, a signal
 	# will be emitted to the dbus. This function is to be used in the python code that
@@ -544,25 +1054,51 @@ class VeDbusItemExport(dbus.service.Object):
 			return None
 
 		self._value = newvalue
-		return {
-			'Value': wrap_dbus_value(newvalue),
-			'Text': self.GetText()
-		}
+		self._wrapped = None
+		self._text = None
+		self._changes = None
+
+		if self._filter is not None:
+			now = monotonic()
+			if not self._filter.accept(newvalue, now):
+				# Held back, GetValue still returns the new value
+				self._filter.schedule(now, self._publish_held_back)
+				return None
+			self._filter.published(newvalue, now)
+
+		return self._get_changes()
+
+	def _publish_held_back(self):
+		if self._value == self._filter.value:
+			return # Went back to what was signalled last
+		now = monotonic()
+		if self._filter.accept(self._value, now):
+			self._filter.published(self._value, now)
+			if self._filter.publisher is not None:
+				self._filter.publisher(self._get_path())
+			else:
+				self.PropertiesChanged(self._get_changes())
+		else:
+			self._filter.schedule(now, self._publish_held_back)
+
+	# Returns the value and text as sent in a PropertiesChanged signal. The
+	# dict is shared, it must not be modified.
+	def _get_changes(self):
+		if self._changes is None:
+			self._changes = {
+				'Value': self._get_wrapped(),
+				'Text': self._get_cached_text()
+			}
+		return self._changes
 
 	def local_get_value(self):
 		return self._value
 
-	# ==== ALL FUNCTIONS BELOW THIS LINE WILL BE CALLED BY OTHER PROCESSES OVER THE DBUS ====
-
-	## Dbus exported method SetValue
-	# Function is called over the D-Bus by other process. It will first check (via callback) if new
-	# value is accepted. And it is, stores it and emits a changed-signal.
-	# @param value The new value.
-	# @return completion-code When successful a 0 is return, and when not a -1 is returned.
-	@dbus.service.method('com.victronenergy.BusItem', in_signature='v', out_signature='i')
-	def SetValue(self, newvalue):
+	# Checks a value written over the dbus, returns the completion-code and the
+	# unwrapped value.
+	def _check_value(self, newvalue):
 		if not self._writeable:
-			return 1  # NOT OK
+			return 1, None  # NOT OK
 
 		newvalue = unwrap_dbus_value(newvalue)
 
@@ -574,7 +1110,15 @@ class VeDbusItemExport(dbus.service.Object):
 			try:
 				newvalue = self._type(newvalue)
 			except (ValueError, TypeError):
-				return 1 # NOT OK
+				return 1, None # NOT OK
+
+		return 0, newvalue
+
+	# Implements SetValue, see VeDbusItemExport.
+	def _set_value(self, newvalue):
+		r, newvalue = self._check_value(newvalue)
+		if r != 0:
+			return r
 
 		if newvalue == self._value:
 			return 0  # OK
@@ -588,6 +1132,88 @@ class VeDbusItemExport(dbus.service.Object):
 
 		return 2  # NOT OK
 
+	def _get_description(self):
+		return self._description if self._description is not None else 'No description given'
+
+	def _get_wrapped(self):
+		if self._wrapped is None:
+			self._wrapped = wrap_dbus_value(self._value)
+		return self._wrapped
+
+	def _get_cached_text(self):
+		if self._text is None:
+			self._text = self._get_text()
+		return self._text
+
+	def _get_text(self):
+		if self._value is None:
+			return '---'
+
+		# Default conversion from dbus.Byte will get you a character (so 'T' instead of '84'), so we
+		# have to convert to int first. Note that if a dbus.Byte turns up here, it must have come from
+		# the application itself, as all data from the D-Bus should have been unwrapped by now.
+		if self._gettextcallback is None and type(self._value) == dbus.Byte:
+			return str(int(self._value))
+
+		if self._gettextcallback is None and self.__dbus_object_path__ == '/ProductId':
+			return "0x%X" % self._value
+
+		if self._gettextcallback is None:
+			return str(self._value)
+
+		return self._gettextcallback(self.__dbus_object_path__, self._value)
+
+class VeDbusItemExport(dbus.service.Object, VeDbusItemBase):
+	## Constructor of VeDbusItemExport
+	#
+	# Use this object to export (publish), values on the dbus
+	# Creates the dbus-object under the given dbus-service-name.
+	# @param bus		  The dbus object.
+	# @param objectPath	  The dbus-object-path.
+	# @param value		  Value to initialize ourselves with, defaults to None which means Invalid
+	# @param description  String containing a description. Can be called over the dbus with GetDescription()
+	# @param writeable	  what would this do!? :).
+	# @param callback	  Function that will be called when someone else changes the value of this VeBusItem
+	#                     over the dbus. First parameter passed to callback will be our path, second the new
+	#					  value. This callback should return True to accept the change, False to reject it.
+	# @param publishfilter  PublishFilter that decides which changes of the value are signalled.
+	def __init__(self, bus, objectPath, value=None, description=None, writeable=False,
+					onchangecallback=None, gettextcallback=None, deletecallback=None,
+					valuetype=None, publishfilter=None):
+		dbus.service.Object.__init__(self, bus, objectPath)
+		self._init_value(value, description, writeable, onchangecallback, gettextcallback,
+			deletecallback, valuetype, publishfilter)
+
+	# To force immediate deregistering of this dbus object, explicitly call __del__().
+	def __del__(self):
+		# self._get_path() will raise an exception when retrieved after the
+		# call to .remove_from_connection, so we need a copy.
+		path = self._get_path()
+		if path == None:
+			return
+		if self._filter is not None:
+			self._filter.cancel()
+		if self._deletecallback is not None:
+			self._deletecallback(path)
+		self.remove_from_connection()
+		logging.debug("VeDbusItemExport %s has been removed" % path)
+
+	def _get_path(self):
+		if len(self._locations) == 0:
+			return None
+		return self._locations[0][1]
+
+	# ==== ALL FUNCTIONS BELOW THIS LINE WILL BE CALLED BY OTHER PROCESSES OVER THE DBUS ====
+
+	## Dbus exported method SetValue
+	# Function is called over the D-Bus by other process. It will first check (via callback) if new
+	# value is accepted. And it is, stores it and emits a changed-signal.
+	# @param value The new value.
+	# @return completion-code When successful a 0 is return, and when not a -1 is returned.
+	@dbus.service.method('com.victronenergy.BusItem', in_signature='v', out_signature='i')
+	def SetValue(self, newvalue):
+		return self._set_value(newvalue)
+
 	## Dbus exported method GetDescription
 	#
 	# Returns the a description.
@@ -596,36 +1222,21 @@ class VeDbusItemExport(dbus.service.Object):
 	# @return description
 	@dbus.service.method('com.victronenergy.BusItem', in_signature='si', out_signature='s')
 	def GetDescription(self, language, length):
-		return self._description if self._description is not None else 'No description given'
+		return self._get_description()
 
 	## Dbus exported method GetValue
 	# Returns the value.
 	# @return the value when valid, and otherwise an empty array
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='v')
 	def GetValue(self):
-		return wrap_dbus_value(self._value)
+		return self._get_wrapped()
 
 	## Dbus exported method GetText
 	# Returns the value as string of the dbus-object-path.
 	# @return text A text-value. '---' when local value is invalid
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='s')
 	def GetText(self):
-		if self._value is None:
-			return '---'
-
-		# Default conversion from dbus.Byte will get you a character (so 'T' instead of '84'), so we
-		# have to convert to int first. Note that if a dbus.Byte turns up here, it must have come from
-		# the application itself, as all data from the D-Bus should have been unwrapped by now.
-		if self._gettextcallback is None and type(self._value) == dbus.Byte:
-			return str(int(self._value))
-
-		if self._gettextcallback is None and self.__dbus_object_path__ == '/ProductId':
-			return "0x%X" % self._value
-
-		if self._gettextcallback is None:
-			return str(self._value)
-
-		return self._gettextcallback(self.__dbus_object_path__, self._value)
+		return self._get_cached_text()
 
 	## The signal that indicates that the value has changed.
 	# Other processes connected to this BusItem object will have subscribed to the
@@ -634,6 +1245,120 @@ class VeDbusItemExport(dbus.service.Object):
 	def PropertiesChanged(self, changes):
 		pass
 
+class VeDbusVirtualItem(VeDbusItemBase):
+	""" An exported item that is not a dbus object of its own. It lives in the
+	    value table of a VeDbusService created with virtual=True, and is served
+	    over the dbus by its VeDbusFallbackExport. It has the same local
+	    interface as VeDbusItemExport. """
+	__slots__ = ('_bus', '__dbus_object_path__', '_onchangecallback', '_gettextcallback', '_value',
+		'_description', '_writeable', '_deletecallback', '_type', '_wrapped', '_text', '_changes',
+		'_filter')
+
+	def __init__(self, bus, objectPath, value=None, description=None, writeable=False,
+					onchangecallback=None, gettextcallback=None, deletecallback=None,
+					valuetype=None, publishfilter=None):
+		self._bus = bus
+		self.__dbus_object_path__ = objectPath
+		self._init_value(value, description, writeable, onchangecallback, gettextcallback,
+			deletecallback, valuetype, publishfilter)
+
+	def __del__(self):
+		path = self._get_path()
+		if path is None:
+			return
+		self.__dbus_object_path__ = None
+		if self._filter is not None:
+			self._filter.cancel()
+		if self._deletecallback is not None:
+			self._deletecallback(path)
+
+	def _get_path(self):
+		return getattr(self, '__dbus_object_path__', None)
+
+	def SetValue(self, newvalue):
+		return self._set_value(newvalue)
+
+	def GetDescription(self, language, length):
+		return self._get_description()
+
+	def GetValue(self):
+		return self._get_wrapped()
+
+	def GetText(self):
+		return self._get_cached_text()
+
+	def PropertiesChanged(self, changes):
+		msg = dbus.lowlevel.SignalMessage(self.__dbus_object_path__, 'com.victronenergy.BusItem',
+			'PropertiesChanged')
+		msg.append(changes, signature='a{sv}')
+		self._bus.send_message(msg)
+
+class PublishFilter(object):
+	""" Decides which changes of the value of a VeDbusItemExport are signalled.
+	    Changes of a numeric value that stay within the deadband around the last
+	    signalled value are held back, as are changes that come sooner than
+	    mininterval ms after the previous signal. A change that is held back is
+	    signalled anyway when mininterval has passed and it is outside the
+	    deadband, or when maxage ms have passed. """
+	def __init__(self, deadband=None, relativedeadband=None, mininterval=None, maxage=None):
+		self.deadband = deadband or 0
+		self.relativedeadband = relativedeadband or 0
+		self.mininterval = (mininterval or 0) / 1000.0
+		self.maxage = None if maxage is None else maxage / 1000.0
+		self.value = None # The value signalled last
+		# Called with the path to signal a held back value, instead of a PropertiesChanged of
+		# its own. Set by VeDbusService for paths with a publish interval.
+		self.publisher = None
+		self._time = 0
+		self._timer = None
+
+	def published(self, value, now):
+		self.value = value
+		self._time = now
+		self.cancel()
+
+	def accept(self, value, now):
+		last = self.value
+		if value == last:
+			return False
+		age = now - self._time
+		if self.maxage is not None and age >= self.maxage:
+			return True
+		if age < self.mininterval:
+			return False
+		# Changes from or to invalid, or of anything that is not a number, are
+		# always signalled.
+		if type(value) not in (int, float) or type(last) not in (int, float):
+			return True
+		band = max(self.deadband, abs(last) * self.relativedeadband)
+		return abs(value - last) > band
+
+	def schedule(self, now, callback):
+		""" Arranges for callback to be called when a held back value may have
+		    to be signalled. """
+		if self._timer is not None:
+			return
+
+		age = now - self._time
+		if age < self.mininterval:
+			delay = self.mininterval - age
+		elif self.maxage is not None:
+			delay = self.maxage - age
+		else:
+			return # Only a later change can leave the deadband
+
+		self._timer = GLib.timeout_add(max(1, int(delay * 1000)), exit_on_error, self._on_timer, callback)
+
+	def _on_timer(self, callback):
+		self._timer = None
+		callback()
+		return False
+
+	def cancel(self):
+		if self._timer is not None:
+			GLib.source_remove(self._timer)
+			self._timer = None
+
 ## This class behaves like a regular reference to a class method (eg. self.foo), but keeps a weak reference
 ## to the object which method is to be called.
 ## Use this object to break circular references.